@@ -27,13 +27,19 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 db.init_app(app)
 
 # Import character manager for displaying data
-from character_manager import CharacterManager
+from character_manager import CharacterManager, get_character_manager
+
+def _get_character_manager() -> CharacterManager:
+    """Get the shared character manager, picking up characters created by the bot process"""
+    character_manager = get_character_manager()
+    character_manager.reload_custom_characters()
+    return character_manager
 
 @app.route('/')
 def index():
     """Home page"""
     # Get character data for display
-    character_manager = CharacterManager()
+    character_manager = _get_character_manager()
     preset_characters = {}
     
     # Separate preset characters from custom ones
@@ -49,7 +55,7 @@ def index():
 @app.route('/characters')
 def characters():
     """Display all available characters"""
-    character_manager = CharacterManager()
+    character_manager = _get_character_manager()
     
     # Get all characters
     all_characters = character_manager.get_all_characters()
@@ -72,7 +78,7 @@ def characters():
 @app.route('/character/<character_id>')
 def character_details(character_id):
     """Display details for a specific character"""
-    character_manager = CharacterManager()
+    character_manager = _get_character_manager()
     
     # Get the character
     character = character_manager.get_character(character_id)
@@ -88,14 +94,14 @@ def character_details(character_id):
 @app.route('/api/characters')
 def api_characters():
     """API endpoint to get all characters"""
-    character_manager = CharacterManager()
+    character_manager = _get_character_manager()
     all_characters = character_manager.get_all_characters()
     return jsonify(all_characters)
 
 @app.route('/api/character/<character_id>')
 def api_character(character_id):
     """API endpoint to get a specific character"""
-    character_manager = CharacterManager()
+    character_manager = _get_character_manager()
     character = character_manager.get_character(character_id)
     
     if not character:
@@ -113,10 +119,11 @@ def about():
     """About page"""
     return render_template('about.html')
 
-# Create all database tables
+# Create all database tables, and add the columns and indexes that tables from earlier versions lack
 with app.app_context():
     import models  # Import models to register them with SQLAlchemy
     db.create_all()
+    models.upgrade_schema()
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,111 @@
+"""
+Benchmark coalescing of rapid-fire messages: simulated users send bursts of short messages
+through handle_message, and the stub LLM counts how many generations were requested with and
+without the debounce window.
+Usage: python benchmarks/bench_coalescing.py [users] [bursts_per_user] [messages_per_burst] [debounce_seconds]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from typing import Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_handler
+import rate_limiter
+from character_manager import CharacterManager
+from update_processor import PerChatUpdateProcessor
+
+class FakeMessage:
+    """Stands in for a telegram Message"""
+    def __init__(self, text: str):
+        self.text = text
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        return FakeMessage(text)
+
+def make_update(user_id: int, text: str) -> SimpleNamespace:
+    """Minimal duck-typed Update for a private chat"""
+    return SimpleNamespace(
+        message=FakeMessage(text),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id)
+    )
+
+async def run(users: int, bursts: int, burst_size: int, debounce: float) -> Tuple[int, int]:
+    """Send every user's bursts and return the number of generations requested, and how many were cancelled"""
+    generations = cancelled = 0
+    
+    async def generate_response(character, conversation_history, character_stats, conversation_summary=None,
+                                character_id=None, memories=None):
+        nonlocal generations, cancelled
+        generations += 1
+        try:
+            await asyncio.sleep(0.2)
+        except asyncio.CancelledError:
+            cancelled += 1
+            raise
+        return "reply", 0.0
+    
+    conversation_handler.generate_response = generate_response
+    conversation_handler.STREAM_RESPONSES = False
+    conversation_handler.MESSAGE_DEBOUNCE_SECONDS = debounce
+    rate_limiter._rate_limiter = rate_limiter.RateLimiter(user_per_minute=0, global_per_second=0)
+    
+    async def send_chat_action(**kwargs) -> None:
+        pass
+    
+    character_manager = CharacterManager()
+    tasks = set()
+    
+    def create_task(coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        return task
+    
+    context = SimpleNamespace(bot_data={"character_manager": character_manager},
+                              bot=SimpleNamespace(send_chat_action=send_chat_action),
+                              application=SimpleNamespace(create_task=create_task))
+    processor = PerChatUpdateProcessor(32)
+    
+    async def user(user_id: int) -> None:
+        user_context = SimpleNamespace(**vars(context), user_data={"selected_character": "sherlock"})
+        for burst in range(bursts):
+            # A few short messages a moment apart, then a pause while reading the reply
+            for index in range(burst_size):
+                update = make_update(user_id, f"burst {burst} message {index}")
+                await processor.process_update(update, conversation_handler.handle_message(update, user_context))
+                await asyncio.sleep(random.uniform(0.1, 0.4))
+            await asyncio.sleep(debounce + 1)
+    
+    await asyncio.gather(*(user(user_id) for user_id in range(users)))
+    while tasks:
+        await asyncio.wait(list(tasks))
+        tasks = {task for task in tasks if not task.done()}
+    return generations, cancelled
+
+async def main(users: int, bursts: int, burst_size: int, debounce: float) -> None:
+    start = time.perf_counter()
+    immediate, _ = await run(users, bursts, burst_size, 0)
+    coalesced, cancelled = await run(users, bursts, burst_size, debounce)
+    
+    print(f"{users} users x {bursts} bursts of {burst_size} messages ({users * bursts * burst_size} messages)")
+    print(f"generations without debounce:      {immediate}")
+    print(f"generations with {debounce:.1f}s debounce:    {coalesced} "
+          f"({(1 - coalesced / immediate) * 100:.0f}% fewer upstream calls, {cancelled} of them cancelled)")
+    print(f"ran in {time.perf_counter() - start:.1f} s")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        asyncio.run(main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 4,
+            float(sys.argv[4]) if len(sys.argv) > 4 else 1.5
+        ))
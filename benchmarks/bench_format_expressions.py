@@ -0,0 +1,74 @@
+"""
+Micro-benchmark of format_emotional_expressions over a corpus of long replies,
+compared with the previous implementation (one regex scan per expression and
+string concatenation), which is kept here as the baseline.
+Usage: python benchmarks/bench_format_expressions.py [replies] [repeats]
+"""
+
+import os
+import re
+import sys
+import random
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_handler import format_emotional_expressions
+
+_OLD_SOUNDS = [
+    r'\b(a+h+)\b', r'\b(u+m+)\b', r'\b(h+m+)\b', r'\b(o+h+)\b',
+    r'\b(w+o+w+)\b', r'\b(h+u+h+)\b', r'\b(e+h+)\b', r'\b(u+h+)\b',
+    r'\b(h+a+h+a+)\b', r'\b(h+e+h+e+)\b', r'\b(t+s+k+)\b', r'\b(s+i+g+h+)\b',
+    r'\b(a+w+w+)\b', r'\b(o+o+p+s+)\b', r'\b(y+a+y+)\b', r'\b(w+h+e+w+)\b',
+    r'\b(p+f+f+t+)\b', r'\b(e+e+k+)\b', r'\b(a+c+k+)\b', r'\b(h+m+p+h+)\b',
+    r'\b(e+r+m+)\b', r'\b(w+e+l+l+)\b'
+]
+
+def old_format_emotional_expressions(text):
+    """The previous implementation, for comparison"""
+    sections = [(m.start(), m.end(), m.group(1)) for m in re.finditer(r'\*(.*?)\*', text)]
+    for pattern in _OLD_SOUNDS:
+        for m in re.finditer(pattern, text, flags=re.IGNORECASE):
+            sections.append((m.start(), m.end(), m.group(1)))
+    sections.sort(key=lambda x: x[0])
+    if not sections:
+        return text
+    special_chars = r'_*[]()~`>#+-=|{}.!'
+    escape_chars = lambda s: ''.join([f'\\{c}' if c in special_chars else c for c in s])
+    result = ""
+    last_end = 0
+    for start, end, content in sections:
+        result += escape_chars(text[last_end:start])
+        result += f'`{content}`'
+        last_end = end
+    if last_end < len(text):
+        result += escape_chars(text[last_end:])
+    return result
+
+_WORDS = (
+    "the detective observed a small stain on the sleeve, which of course told him everything. "
+    "Well, that is hardly surprising (given the circumstances)! umm I suppose... ahh yes. "
+    "*adjusts coat* hmm, remarkable - truly. *sigh* oh well, the game is afoot: 3 + 4 = 7. "
+).split(" ")
+
+def build_corpus(replies: int, words_per_reply: int = 600, seed: int = 7):
+    """Long synthetic replies mixing prose, punctuation and emotional expressions"""
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(_WORDS) for _ in range(words_per_reply)) for _ in range(replies)]
+
+def main(replies: int, repeats: int) -> None:
+    corpus = build_corpus(replies)
+    chars = sum(len(reply) for reply in corpus)
+    
+    old = min(timeit.repeat(lambda: [old_format_emotional_expressions(r) for r in corpus], number=1, repeat=repeats))
+    new = min(timeit.repeat(lambda: [format_emotional_expressions(r) for r in corpus], number=1, repeat=repeats))
+    
+    print(f"{replies} replies, {chars / replies:.0f} characters each")
+    print(f"previous implementation: {old / replies * 1e6:.1f} us/reply")
+    print(f"single-pass formatter:   {new / replies * 1e6:.1f} us/reply ({old / new:.1f}x faster)")
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    )
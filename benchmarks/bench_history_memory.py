@@ -0,0 +1,68 @@
+"""
+Benchmark the in-memory conversation history: memory used by many full conversations stored as
+lists of dicts versus ConversationHistory ring buffers of Message records, and the cost of
+appending to a full conversation (list append + slice versus ring buffer push).
+Usage: python benchmarks/bench_history_memory.py [conversations] [messages_per_conversation]
+"""
+
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_history import ConversationHistory, Message
+
+def measure(build) -> int:
+    """Bytes allocated by build() that are still alive afterwards"""
+    tracemalloc.start()
+    result = build()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return allocated
+
+def main(conversations: int, messages: int) -> None:
+    # The contents are shared by both layouts so only the per-message overhead is compared
+    contents = [f"message number {index} of a fairly ordinary conversation" for index in range(messages)]
+    roles = ["user" if index % 2 == 0 else "assistant" for index in range(messages)]
+    
+    dict_bytes = measure(lambda: [
+        [{"role": role, "content": content, "tokens": 12} for role, content in zip(roles, contents)]
+        for _ in range(conversations)
+    ])
+    record_bytes = measure(lambda: [
+        ConversationHistory((Message(role, content, 12) for role, content in zip(roles, contents)), messages)
+        for _ in range(conversations)
+    ])
+    
+    appends = 100000
+    history = [{"role": role, "content": content, "tokens": 12} for role, content in zip(roles, contents)]
+    start = time.perf_counter()
+    for index in range(appends):
+        history.append({"role": "user", "content": contents[index % messages], "tokens": 12})
+        if len(history) > messages:
+            evicted = history[:-messages]
+            history = history[-messages:]
+    list_time = time.perf_counter() - start
+    
+    ring = ConversationHistory((Message(role, content, 12) for role, content in zip(roles, contents)), messages)
+    start = time.perf_counter()
+    for index in range(appends):
+        evicted = ring.push(Message("user", contents[index % messages], 12))
+    ring_time = time.perf_counter() - start
+    
+    print(f"{conversations} conversations x {messages} messages")
+    print(f"lists of dicts:                  {dict_bytes / 1024 / 1024:.1f} MiB "
+          f"({dict_bytes / conversations / messages:.0f} bytes per message)")
+    print(f"ring buffers of message records: {record_bytes / 1024 / 1024:.1f} MiB "
+          f"({record_bytes / conversations / messages:.0f} bytes per message)")
+    print(f"append to a full conversation: list + slice {list_time / appends * 1e6:.2f} us, "
+          f"ring buffer {ring_time / appends * 1e6:.2f} us")
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    )
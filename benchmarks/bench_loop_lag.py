@@ -0,0 +1,65 @@
+"""
+Show that storage no longer stalls the event loop: simulated chat turns mutate many
+users' conversations while EventLoopLagMonitor samples loop lag, first with every save
+written synchronously on the loop, then with write-behind flushing through AsyncUserStore.
+Usage: python benchmarks/bench_loop_lag.py [users] [turns] [history_messages]
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from character_manager import CharacterManager
+from conversation_history import Message
+from data_storage import MonolithicUserStore
+
+async def simulate(character_manager: CharacterManager, users: int, turns: int) -> None:
+    """Chat turns from many users, yielding to the loop between turns like real handlers"""
+    for turn in range(turns):
+        for user_id in range(users):
+            character_manager.add_to_conversation_history(user_id, "sherlock", "user", f"turn {turn} " * 40)
+            character_manager.add_to_conversation_history(user_id, "sherlock", "assistant", f"reply {turn} " * 80)
+            await asyncio.sleep(0)
+
+async def measure(label: str, users: int, turns: int, history: int, write_behind: bool) -> None:
+    store = MonolithicUserStore(os.path.join("data", "user_data.json"))
+    character_manager = CharacterManager(user_store=store, flush_interval=0.2)
+    for user_id in range(users):
+        messages = character_manager.get_conversation_history(user_id, "sherlock")
+        for index in range(history):
+            messages.push(Message("user", f"old message {index} " * 20))
+    
+    if write_behind:
+        await character_manager.start_write_behind()
+    
+    metrics._summaries.pop("event_loop_lag_seconds", None)
+    monitor = metrics.EventLoopLagMonitor(interval=0.01, log_interval=0)
+    monitor.start()
+    await simulate(character_manager, users, turns)
+    await monitor.stop()
+    
+    if write_behind:
+        await character_manager.stop_write_behind()
+    
+    lag = metrics.snapshot()["summaries"]["event_loop_lag_seconds"]
+    print(f"{label}: loop lag avg {lag['avg'] * 1000:.1f} ms, max {lag['max'] * 1000:.1f} ms "
+          f"over {lag['count']} samples")
+
+async def main(users: int, turns: int, history: int) -> None:
+    print(f"{users} users, {turns} turns each, {history} messages of history per user")
+    await measure("synchronous saves", users, turns, history, write_behind=False)
+    await measure("write-behind     ", users, turns, history, write_behind=True)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        os.environ["PERSIST_JOURNAL"] = "false"
+        asyncio.run(main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 3,
+            int(sys.argv[3]) if len(sys.argv) > 3 else 50
+        ))
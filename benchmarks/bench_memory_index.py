@@ -0,0 +1,70 @@
+"""
+Benchmark long-term memory retrieval: fills one conversation's index with synthetic messages,
+then times top-k searches like the one done on every turn, and the load of the index from disk.
+Usage: python benchmarks/bench_memory_index.py [memories] [searches]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_index import MemoryIndex, MemoryStore
+
+WORDS = (
+    "garden", "violin", "london", "tea", "murder", "letter", "train", "rain", "dog", "birthday", "sister",
+    "paris", "painting", "cake", "holiday", "exam", "river", "castle", "coffee", "moon", "secret", "ring",
+    "doctor", "piano", "storm", "book", "friend", "market", "wedding", "ship", "poem", "forest", "key",
+    "lamp", "clock", "mystery", "pipe", "fog", "bridge", "dance", "letters", "bakery", "island", "horse"
+)
+
+def make_messages(count: int, rng: random.Random) -> list:
+    """Synthetic messages of 6 to 20 words from a small vocabulary"""
+    return [
+        {"role": rng.choice(("user", "assistant")),
+         "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 20)))}
+        for _ in range(count)
+    ]
+
+async def main(memories: int, searches: int) -> None:
+    rng = random.Random(0)
+    messages = make_messages(memories, rng)
+    queries = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))) for _ in range(searches)]
+    
+    index = MemoryIndex(max_memories=memories)
+    start = time.perf_counter()
+    for message in messages:
+        index.add([message["content"]])
+    add_time = time.perf_counter() - start
+    
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, 3)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    
+    with tempfile.TemporaryDirectory() as data_dir:
+        store = MemoryStore(data_dir, max_memories=memories)
+        store.add(1, "sherlock", messages)
+        start = time.perf_counter()
+        await store.search(1, "sherlock", queries[0])
+        load_time = time.perf_counter() - start
+        store.close()
+    
+    print(f"{memories} memories, {index._vectors.shape[1]} dimensions, "
+          f"{index._vectors.nbytes / 1024 / 1024:.1f} MiB of vectors")
+    print(f"adding one at a time: {add_time / memories * 1e6:.1f} us per memory")
+    print(f"search top-3: p50 {timings[searches // 2] * 1000:.3f} ms, "
+          f"p99 {timings[int(searches * 0.99)] * 1000:.3f} ms, max {timings[-1] * 1000:.3f} ms")
+    print(f"first search including the load from disk: {load_time * 1000:.1f} ms (on the memory thread)")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    ))
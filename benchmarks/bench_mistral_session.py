@@ -0,0 +1,75 @@
+"""
+Benchmark the pooled Mistral client against a fresh aiohttp session per request.
+
+Runs a local stub of the chat completions endpoint and times sequential requests
+both ways. Usage: python benchmarks/bench_mistral_session.py [requests]
+"""
+
+import os
+import sys
+import time
+import asyncio
+import aiohttp
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mistral_integration import MistralClient
+
+COMPLETION = {"choices": [{"message": {"role": "assistant", "content": "Elementary, my dear Watson."}}]}
+PAYLOAD = {"model": "mistral-medium", "messages": [{"role": "user", "content": "hi"}]}
+
+async def _stub_completion(request: web.Request) -> web.Response:
+    """Stub of the chat completions endpoint"""
+    await request.read()
+    return web.json_response(COMPLETION)
+
+async def _start_stub_server() -> web.AppRunner:
+    """Start the stub server on a free local port"""
+    stub_app = web.Application()
+    stub_app.router.add_post("/v1/chat/completions", _stub_completion)
+    runner = web.AppRunner(stub_app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+async def _time_fresh_sessions(url: str, requests: int) -> float:
+    """Time requests that each open their own session, like the old generate_response"""
+    start = time.perf_counter()
+    for _ in range(requests):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(url, json=PAYLOAD) as response:
+                await response.json()
+    return time.perf_counter() - start
+
+async def _time_pooled_client(url: str, requests: int) -> float:
+    """Time requests through one pooled MistralClient"""
+    client = MistralClient(api_url=url)
+    await client.start()
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            await client.chat_completion(PAYLOAD, "benchmark-key")
+        return time.perf_counter() - start
+    finally:
+        await client.close()
+
+async def main(requests: int) -> None:
+    runner = await _start_stub_server()
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    
+    try:
+        fresh = await _time_fresh_sessions(url, requests)
+        pooled = await _time_pooled_client(url, requests)
+    finally:
+        await runner.cleanup()
+    
+    print(f"{requests} requests against {url}")
+    print(f"fresh session per request: {fresh / requests * 1000:.3f} ms/request")
+    print(f"pooled client:             {pooled / requests * 1000:.3f} ms/request")
+    print(f"saved per request:         {(fresh - pooled) / requests * 1000:.3f} ms "
+          "(plain HTTP; a TLS handshake to api.mistral.ai adds more)")
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 500))
@@ -0,0 +1,56 @@
+"""
+Benchmark the opening-turn response cache: new conversations greet preset characters through
+generate_response with the FakeProvider, with and without the cache, and report latency and hit rate.
+Usage: python benchmarks/bench_response_cache.py [conversations] [latency_seconds]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+from llm_providers import FakeProvider, set_provider
+from mistral_integration import generate_response
+from preset_characters import PRESET_CHARACTERS
+from response_cache import ResponseCache, set_response_cache
+
+GREETINGS = ("hi", "Hi!", "hello", "Hello!!", "hey", "hi there", "Hello?", "good morning")
+STATS = {"mood": 5, "conversation_count": 1, "personality_stats": {}}
+
+async def run(conversations: int) -> float:
+    """Open conversations one after another and return the average latency of the first reply"""
+    rng = random.Random(0)
+    character_ids = list(PRESET_CHARACTERS)
+    start = time.perf_counter()
+    for _ in range(conversations):
+        character_id = rng.choice(character_ids)
+        history = [{"role": "user", "content": rng.choice(GREETINGS)}]
+        await generate_response(PRESET_CHARACTERS[character_id], history, STATS, None, character_id)
+    return (time.perf_counter() - start) / conversations
+
+async def main(conversations: int, latency: float) -> None:
+    set_provider(FakeProvider(latency=latency, tokens_per_second=1000))
+    
+    set_response_cache(None)
+    uncached = await run(conversations)
+    
+    set_response_cache(ResponseCache())
+    cached = await run(conversations)
+    
+    counters = metrics.snapshot()["counters"]
+    hits = counters.get("response_cache_hits", 0)
+    misses = counters.get("response_cache_misses", 0)
+    print(f"{conversations} opening turns, fake LLM {latency * 1000:.0f} ms")
+    print(f"without cache: {uncached * 1000:.1f} ms per opening reply")
+    print(f"with cache:    {cached * 1000:.1f} ms per opening reply "
+          f"({hits:.0f} hits, {misses:.0f} misses, hit rate {hits / (hits + misses) * 100:.0f}%)")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 500,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    ))
@@ -0,0 +1,88 @@
+"""
+Benchmark the data file serializers: saves and loads a synthetic user_data.json with many users
+through save_json_file / load_json_file with each available serializer, next to the previous
+indented stdlib JSON, and reports times and file sizes.
+Usage: python benchmarks/bench_serializers.py [users] [messages_per_user]
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import data_storage
+from conversation_history import ConversationHistory, to_json
+from data_storage import JSONSerializer, MsgpackSerializer, OrjsonSerializer, load_json_file, save_json_file, set_serializer
+from preset_characters import PRESET_CHARACTERS
+
+WORDS = ("the", "detective", "looked", "at", "rain", "and", "smiled", "quite", "so", "my", "dear", "friend",
+         "what", "do", "you", "think", "about", "this", "case", "tea", "violin", "letter", "évidemment", "🙂")
+
+class IndentedJSONSerializer(JSONSerializer):
+    """What save_json_file wrote before: stdlib JSON with indent=2"""
+    name = "json indent=2"
+    
+    def dumps(self, data) -> bytes:
+        return json.dumps(data, indent=2, ensure_ascii=False, default=to_json).encode("utf-8")
+
+def make_user_data(users: int, messages: int) -> dict:
+    """Synthetic users shaped like CharacterManager records"""
+    rng = random.Random(0)
+    character_ids = list(PRESET_CHARACTERS)
+    user_data = {}
+    for user_id in range(users):
+        character_id = rng.choice(character_ids)
+        history = []
+        for index in range(messages):
+            content = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 30)))
+            history.append({"role": "user" if index % 2 == 0 else "assistant", "content": content,
+                            "tokens": len(content) // 4})
+        user_data[str(100000000 + user_id)] = {
+            "selected_character": character_id,
+            "custom_characters": [],
+            "character_stats": {character_id: {
+                "mood": rng.randint(1, 10),
+                "conversation_count": rng.randint(0, 50),
+                "personality_stats": {"friendliness": 5, "humor": 6, "intelligence": 7, "empathy": 5, "energy": 4}
+            }},
+            "conversation_history": {character_id: ConversationHistory(history, 100)},
+            "conversation_summaries": {}
+        }
+    return user_data
+
+def main(users: int, messages: int) -> None:
+    user_data = make_user_data(users, messages)
+    serializers = [IndentedJSONSerializer(), JSONSerializer()]
+    if data_storage.orjson is not None:
+        serializers.append(OrjsonSerializer())
+    if data_storage.msgpack is not None:
+        serializers.append(MsgpackSerializer())
+    
+    print(f"{users} users x {messages} messages; JSON files are read with "
+          f"{'orjson' if data_storage.orjson is not None else 'the standard library'}")
+    with tempfile.TemporaryDirectory() as data_dir:
+        for serializer in serializers:
+            set_serializer(serializer)
+            path = os.path.join(data_dir, "user_data.json")
+            
+            start = time.perf_counter()
+            assert save_json_file(path, user_data)
+            save_time = time.perf_counter() - start
+            
+            start = time.perf_counter()
+            loaded = load_json_file(path)
+            load_time = time.perf_counter() - start
+            assert len(loaded) == users
+            
+            print(f"{serializer.name:>14}: save {save_time:6.2f} s, load {load_time:6.2f} s, "
+                  f"{os.path.getsize(path) / 1024 / 1024:7.1f} MiB")
+
+if __name__ == "__main__":
+    main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    )
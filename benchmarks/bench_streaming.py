@@ -0,0 +1,95 @@
+"""
+Measure time to first visible text for streamed vs. non-streamed replies.
+
+Runs a local fake server that produces a completion token by token, both as one JSON
+response and as server-sent events, and replays the stream through StreamingReply with
+a fake Telegram message that records sends and edits.
+Usage: python benchmarks/bench_streaming.py [tokens] [seconds_per_token]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conversation_handler import StreamingReply
+from mistral_integration import MistralClient
+
+PAYLOAD = {"model": "mistral-medium", "messages": [{"role": "user", "content": "hi"}]}
+
+def _make_fake_server(tokens: int, seconds_per_token: float) -> web.Application:
+    """Fake chat completions endpoint generating `tokens` words at a fixed rate"""
+    words = [f"word{i} " for i in range(tokens)]
+    
+    async def completion(request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        if not body.get("stream"):
+            await asyncio.sleep(seconds_per_token * tokens)
+            return web.json_response({"choices": [{"message": {"role": "assistant", "content": "".join(words)}}]})
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in words:
+            await asyncio.sleep(seconds_per_token)
+            chunk = {"choices": [{"index": 0, "delta": {"content": word}}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        await response.write(b"data: [DONE]\n\n")
+        return response
+    
+    fake_app = web.Application()
+    fake_app.router.add_post("/v1/chat/completions", completion)
+    return fake_app
+
+class FakeMessage:
+    """Stands in for a telegram Message, recording what would be sent"""
+    def __init__(self, started_at: float):
+        self.started_at = started_at
+        self.first_sent_at = None
+        self.edits = 0
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        if self.first_sent_at is None:
+            self.first_sent_at = time.perf_counter() - self.started_at
+        return self
+    
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        self.edits += 1
+        return self
+
+async def main(tokens: int, seconds_per_token: float) -> None:
+    runner = web.AppRunner(_make_fake_server(tokens, seconds_per_token))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}/v1/chat/completions"
+    client = MistralClient(api_url=url)
+    
+    try:
+        start = time.perf_counter()
+        await client.chat_completion(PAYLOAD, "benchmark-key")
+        full_latency = time.perf_counter() - start
+        
+        start = time.perf_counter()
+        message = FakeMessage(start)
+        reply = StreamingReply(message, edit_interval=0.2)
+        async for delta in client.stream_chat_completion(PAYLOAD, "benchmark-key"):
+            await reply.add(delta)
+        await reply.finish()
+        stream_latency = time.perf_counter() - start
+    finally:
+        await client.close()
+        await runner.cleanup()
+    
+    print(f"{tokens} tokens at {seconds_per_token * 1000:.0f} ms/token")
+    print(f"non-streamed: first visible text after {full_latency * 1000:.0f} ms")
+    print(f"streamed:     first visible text after {message.first_sent_at * 1000:.0f} ms, "
+          f"complete after {stream_latency * 1000:.0f} ms with {message.edits} edits")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    ))
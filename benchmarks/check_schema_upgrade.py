@@ -0,0 +1,126 @@
+"""
+Offline check that the database user store works on a database created by the original models.
+
+Creates a SQLite file with the original schema and a user, conversation and stats row in it,
+then imports app.py, which upgrades the schema at startup, and checks through SQLAlchemyUserStore
+that the existing user loads and a new user's messages save and load back, also when the same
+changes are saved again, as a journal replayed after a flush that had already committed them does.
+Usage: python benchmarks/check_schema_upgrade.py
+"""
+
+import os
+import sys
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The tables as db.create_all() made them before the database store was added
+ORIGINAL_SCHEMA = """
+CREATE TABLE user (
+    id INTEGER NOT NULL,
+    telegram_id INTEGER,
+    username VARCHAR(64),
+    first_name VARCHAR(64),
+    last_name VARCHAR(64),
+    created_at DATETIME,
+    last_active DATETIME,
+    PRIMARY KEY (id),
+    UNIQUE (telegram_id)
+);
+CREATE TABLE conversation (
+    id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    character_id VARCHAR(64) NOT NULL,
+    total_messages INTEGER,
+    created_at DATETIME,
+    last_active DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE character_stat (
+    id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    character_id VARCHAR(64) NOT NULL,
+    mood FLOAT,
+    conversation_count INTEGER,
+    last_interaction DATETIME,
+    personality_json TEXT,
+    PRIMARY KEY (id),
+    FOREIGN KEY(user_id) REFERENCES user (id)
+);
+CREATE TABLE conversation_message (
+    id INTEGER NOT NULL,
+    conversation_id INTEGER NOT NULL,
+    role VARCHAR(10) NOT NULL,
+    content TEXT NOT NULL,
+    timestamp DATETIME,
+    PRIMARY KEY (id),
+    FOREIGN KEY(conversation_id) REFERENCES conversation (id)
+);
+INSERT INTO user (id, telegram_id, username) VALUES (1, 111, 'existing');
+INSERT INTO conversation (id, user_id, character_id, total_messages) VALUES (1, 1, 'sherlock', 2);
+INSERT INTO conversation_message (conversation_id, role, content, timestamp)
+    VALUES (1, 'user', 'Hello Holmes', '2025-04-01 10:00:00'), (1, 'assistant', 'Good morning', '2025-04-01 10:00:05');
+INSERT INTO character_stat (user_id, character_id, mood, conversation_count, personality_json)
+    VALUES (1, 'sherlock', 6, 1, '{"humor": 4}');
+"""
+
+def main() -> None:
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        database_file = os.path.join(data_root, "original.db")
+        with sqlite3.connect(database_file) as connection:
+            connection.executescript(ORIGINAL_SCHEMA)
+        os.environ["DATABASE_URL"] = f"sqlite:///{database_file}"
+        
+        # Importing the store imports app.py, which creates and upgrades the tables
+        from db_storage import SQLAlchemyUserStore
+        store = SQLAlchemyUserStore()
+        
+        existing = store.load_user("111")
+        assert existing is not None, "existing user not found"
+        assert [m["content"] for m in existing["conversation_history"]["sherlock"]] == ["Hello Holmes", "Good morning"]
+        assert existing["character_stats"]["sherlock"]["mood"] == 6
+        print("existing user loads:", existing["conversation_history"]["sherlock"])
+        
+        # A Telegram id beyond 32 bits, a selected character and a message with its token count
+        user_id = str(7_000_000_000)
+        record = {
+            "selected_character": "sherlock",
+            "custom_characters": [],
+            "character_stats": {"sherlock": {"mood": 7, "conversation_count": 1, "personality_stats": {"humor": 5}}},
+            "conversation_history": {"sherlock": [{"role": "user", "content": "Any cases today?", "tokens": 5}]},
+            "conversation_summaries": {}
+        }
+        mutations = {user_id: [["append", "sherlock", "user", "Any cases today?", 5, "a1"]]}
+        assert store.save({user_id: record}, [user_id], mutations), "save failed"
+        
+        loaded = store.load_user(user_id)
+        assert loaded["selected_character"] == "sherlock"
+        assert loaded["conversation_history"]["sherlock"] == record["conversation_history"]["sherlock"]
+        print("new user saves and loads:", loaded["conversation_history"]["sherlock"])
+        
+        # A reset and a new message, saved twice; the second save must not store them again
+        record["conversation_history"]["sherlock"] = [{"role": "user", "content": "A new case", "tokens": 3}]
+        mutations = {user_id: [["reset", "sherlock", "r1"], ["append", "sherlock", "user", "A new case", 3, "a2"]]}
+        for _ in range(2):
+            assert store.save({user_id: record}, [user_id], mutations), "save failed"
+        loaded = store.load_user(user_id)
+        assert loaded["conversation_history"]["sherlock"] == record["conversation_history"]["sherlock"], \
+            loaded["conversation_history"]["sherlock"]
+        with sqlite3.connect(database_file) as connection:
+            counts = connection.execute("SELECT COUNT(*), SUM(total_messages) FROM conversation "
+                                        "WHERE user_id = (SELECT id FROM user WHERE telegram_id = ?)",
+                                        (int(user_id),)).fetchone()
+        assert counts == (2, 2), counts
+        print("changes saved again are skipped:", loaded["conversation_history"]["sherlock"])
+        
+        with sqlite3.connect(database_file) as connection:
+            indexes = sorted(row[0] for row in connection.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'ix_%'"))
+        print("indexes:", ", ".join(indexes))
+        print("schema upgrade OK")
+
+if __name__ == "__main__":
+    main()
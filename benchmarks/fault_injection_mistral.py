@@ -0,0 +1,94 @@
+"""
+Exercise the Mistral client's timeouts, retries and circuit breaker against a fault-injecting stub.
+
+Runs a local stub of the chat completions endpoint that answers each request with the next
+fault of a scripted sequence (error statuses, Retry-After, hangs) and reports how the client
+handled every scenario. Usage: python benchmarks/fault_injection_mistral.py
+"""
+
+import os
+import sys
+import time
+import asyncio
+from typing import List
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mistral_integration import CircuitBreaker, MistralAPIError, MistralClient, MistralUnavailableError
+
+COMPLETION = {"choices": [{"message": {"role": "assistant", "content": "Elementary, my dear Watson."}}]}
+PAYLOAD = {"model": "mistral-medium", "messages": [{"role": "user", "content": "hi"}]}
+
+class FaultInjector:
+    """Scripted faults: each request takes the next one, "ok" once the script runs out"""
+    def __init__(self):
+        self.faults: List[str] = []
+        self.requests = 0
+    
+    def script(self, *faults: str) -> None:
+        self.faults = list(faults)
+        self.requests = 0
+    
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        await request.read()
+        self.requests += 1
+        fault = self.faults.pop(0) if self.faults else "ok"
+        
+        if fault == "hang":
+            await asyncio.sleep(30)
+        if fault.startswith("retry-after:"):
+            return web.Response(status=429, headers={"Retry-After": fault.split(":", 1)[1]}, text="slow down")
+        if fault.isdigit():
+            return web.Response(status=int(fault), text=f"injected {fault}")
+        return web.json_response(COMPLETION)
+
+async def _start_stub_server(injector: FaultInjector) -> web.AppRunner:
+    """Start the stub server on a free local port"""
+    stub_app = web.Application()
+    stub_app.router.add_post("/v1/chat/completions", injector.handle)
+    runner = web.AppRunner(stub_app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", 0).start()
+    return runner
+
+async def _run(client: MistralClient, injector: FaultInjector, name: str, *faults: str) -> None:
+    """Send one request through the scripted faults and report the outcome"""
+    injector.script(*faults)
+    start = time.perf_counter()
+    try:
+        await client.chat_completion(PAYLOAD, "fault-injection-key")
+        outcome = "ok"
+    except MistralUnavailableError:
+        outcome = "rejected, circuit open"
+    except MistralAPIError as e:
+        outcome = f"failed: {e}"
+    elapsed = time.perf_counter() - start
+    print(f"{name:<32} {outcome:<40} {injector.requests} sent  {elapsed * 1000:8.1f} ms")
+
+async def main() -> None:
+    injector = FaultInjector()
+    runner = await _start_stub_server(injector)
+    port = runner.addresses[0][1]
+    url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    
+    client = MistralClient(api_url=url, request_timeout=0.5, connect_timeout=0.5, max_retries=3,
+                           backoff_base=0.05, backoff_max=2, circuit_breaker=CircuitBreaker(5, 1.0))
+    try:
+        await _run(client, injector, "healthy")
+        await _run(client, injector, "two 503s then ok", "503", "503")
+        await _run(client, injector, "429 with Retry-After: 1", "retry-after:1")
+        await _run(client, injector, "429 with Retry-After: 60", "retry-after:60")
+        await _run(client, injector, "hang past the timeout", "hang")
+        await _run(client, injector, "400 is not retried", "400")
+        await _run(client, injector, "persistent 500s", *["500"] * 10)
+        await _run(client, injector, "while the circuit is open", *["500"] * 10)
+        await asyncio.sleep(1.1)
+        await _run(client, injector, "probe after the cooldown")
+        await _run(client, injector, "after recovery")
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    asyncio.run(main())
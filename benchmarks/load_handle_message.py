@@ -0,0 +1,162 @@
+"""
+Load test: many simulated users chatting through handle_message at the same time,
+with the LLM replaced by a stub that only sleeps. Updates go through the bot's
+PerChatUpdateProcessor, and the test checks that every conversation history kept
+the order in which its user sent messages. It then repeats with the debounce window,
+with and without cancelling replies on new messages, and checks that every request
+ends with a user message and every history alternates, ending with a reply.
+Usage: python benchmarks/load_handle_message.py [users] [messages_per_user] [llm_latency_seconds] [concurrency]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from types import SimpleNamespace
+from typing import Dict, List, Set, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_handler
+import rate_limiter
+from character_manager import CharacterManager
+from update_processor import PerChatUpdateProcessor
+
+class FakeMessage:
+    """Stands in for a telegram Message"""
+    def __init__(self, text: str):
+        self.text = text
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        return FakeMessage(text)
+
+def make_stub_llm(latency: float, requests: list):
+    """LLM stub that answers after `latency` seconds, with some jitter, recording the roles of every request"""
+    async def generate_response(character, conversation_history, character_stats, conversation_summary=None,
+                                character_id=None, memories=None):
+        requests.append([m["role"] for m in conversation_history])
+        await asyncio.sleep(latency * random.uniform(0.5, 1.5))
+        return f"reply to {conversation_history[-1]['content']}", 0.0
+    return generate_response
+
+def make_update(user_id: int, text: str) -> SimpleNamespace:
+    """Minimal duck-typed Update for a private chat"""
+    return SimpleNamespace(
+        message=FakeMessage(text),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id)
+    )
+
+def check_histories(character_manager: CharacterManager, user_ids: range, messages_per_user: int) -> Tuple[int, int]:
+    """
+    Count the conversations whose user messages are out of order, and those that don't alternate
+    properly: two replies in a row, or a last message still waiting for its reply
+    """
+    out_of_order = malformed = 0
+    for user_id in user_ids:
+        history = character_manager.get_conversation_history(user_id, "sherlock")
+        sent = [m["content"] for m in history if m["role"] == "user"]
+        if sent != [f"message {index}" for index in range(messages_per_user)][-len(sent):]:
+            out_of_order += 1
+        roles = [m["role"] for m in history]
+        if not roles or roles[-1] != "assistant" or any(a == b == "assistant" for a, b in zip(roles, roles[1:])):
+            malformed += 1
+    return out_of_order, malformed
+
+async def run_debounced(character_manager: CharacterManager, contexts: Dict, processor: PerChatUpdateProcessor,
+                        user_ids: range, messages_per_user: int, latency: float, cancel: bool,
+                        tasks: Set[asyncio.Task], requests: List[List[str]]) -> None:
+    """Users send messages up to a debounce window and a reply apart, so some arrive while an earlier reply is generated"""
+    conversation_handler.CANCEL_ON_NEW_MESSAGE = cancel
+    requests.clear()
+    
+    async def user(user_id: int) -> None:
+        for index in range(messages_per_user):
+            update = make_update(user_id, f"message {index}")
+            await processor.process_update(update, conversation_handler.handle_message(update, contexts[user_id]))
+            await asyncio.sleep(random.uniform(0, conversation_handler.MESSAGE_DEBOUNCE_SECONDS + latency))
+    
+    await asyncio.gather(*(user(user_id) for user_id in user_ids))
+    while tasks:
+        await asyncio.wait(list(tasks))
+        tasks.difference_update({task for task in tasks if task.done()})
+    
+    out_of_order, malformed = check_histories(character_manager, user_ids, messages_per_user)
+    not_ending_with_user = sum(1 for roles in requests if roles[-1] != "user")
+    print(f"debounced ({conversation_handler.MESSAGE_DEBOUNCE_SECONDS}s, cancel on new message {cancel}): "
+          f"{len(requests)} generations, {not_ending_with_user} not ending with a user message, "
+          f"{out_of_order} conversations out of order, {malformed} not alternating")
+
+async def main(users: int, messages_per_user: int, latency: float, concurrency: int) -> None:
+    character_manager = CharacterManager()
+    requests = []
+    conversation_handler.generate_response = make_stub_llm(latency, requests)
+    conversation_handler.STREAM_RESPONSES = False
+    debounce = conversation_handler.MESSAGE_DEBOUNCE_SECONDS
+    # Reply inline first so latency covers the whole turn (see bench_coalescing.py for the debounced path)
+    conversation_handler.MESSAGE_DEBOUNCE_SECONDS = 0
+    # Measure the handler itself, not the admission limits
+    rate_limiter._rate_limiter = rate_limiter.RateLimiter(user_per_minute=0, global_per_second=0)
+    
+    async def send_chat_action(**kwargs) -> None:
+        pass
+    
+    tasks = set()
+    
+    def create_task(coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        tasks.add(task)
+        return task
+    
+    bot = SimpleNamespace(send_chat_action=send_chat_action)
+    application = SimpleNamespace(create_task=create_task)
+    contexts = {
+        user_id: SimpleNamespace(user_data={"selected_character": "sherlock"},
+                                 bot_data={"character_manager": character_manager},
+                                 bot=bot, application=application)
+        for user_id in range(users * 3)
+    }
+    
+    processor = PerChatUpdateProcessor(concurrency)
+    latencies = []
+    
+    async def process(user_id: int, index: int) -> None:
+        update = make_update(user_id, f"message {index}")
+        start = time.perf_counter()
+        await processor.process_update(update, conversation_handler.handle_message(update, contexts[user_id]))
+        latencies.append(time.perf_counter() - start)
+    
+    # Each user sends their messages in quick succession, interleaved with everyone else's
+    start = time.perf_counter()
+    tasks_inline = [asyncio.create_task(process(user_id, index))
+                    for index in range(messages_per_user) for user_id in range(users)]
+    await asyncio.gather(*tasks_inline)
+    elapsed = time.perf_counter() - start
+    
+    out_of_order, _ = check_histories(character_manager, range(users), messages_per_user)
+    
+    latencies.sort()
+    total = users * messages_per_user
+    print(f"{users} users x {messages_per_user} messages, stub LLM ~{latency * 1000:.0f} ms, "
+          f"concurrency {concurrency}")
+    print(f"throughput: {total / elapsed:.1f} updates/s over {elapsed:.2f} s")
+    print(f"latency p50 {latencies[total // 2] * 1000:.0f} ms, p99 {latencies[int(total * 0.99)] * 1000:.0f} ms")
+    print(f"conversations out of order: {out_of_order}")
+    
+    # Then the default debounced path, with and without cancelling replies, on fresh conversations
+    conversation_handler.MESSAGE_DEBOUNCE_SECONDS = debounce
+    for offset, cancel in ((1, True), (2, False)):
+        await run_debounced(character_manager, contexts, processor, range(users * offset, users * (offset + 1)),
+                            messages_per_user, latency, cancel, tasks, requests)
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        asyncio.run(main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 200,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+            float(sys.argv[3]) if len(sys.argv) > 3 else 0.2,
+            int(sys.argv[4]) if len(sys.argv) > 4 else 32
+        ))
@@ -0,0 +1,130 @@
+"""
+POST copies of the recorded update in benchmarks/update.json to the webhook endpoint, all at once,
+and count the responses. Each copy gets its own update_id and user so they are handled concurrently.
+
+Without a URL the endpoint runs in-process: the webhook app in front of an Application whose only
+handler sleeps, with a small update processor and a stub Bot API, so no Telegram access is needed.
+It shows updates beyond the processor's capacity being answered with 503 instead of piling up.
+With a URL the copies go to a running bot, using WEBHOOK_SECRET_TOKEN.
+Usage: python benchmarks/post_webhook_updates.py [count] [url]
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+from collections import Counter
+from aiohttp import ClientSession, web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.ext import Application, ContextTypes, TypeHandler
+
+import webhook
+from update_processor import PerChatUpdateProcessor
+
+UPDATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "update.json")
+SECRET_TOKEN = "benchmark-secret"
+BOT_API_PORT = 8081
+WEBHOOK_PORT = 8082
+HANDLER_SECONDS = 0.5
+
+def make_updates(count: int) -> list:
+    """Copies of the recorded update with distinct update ids and senders"""
+    with open(UPDATE_FILE) as f:
+        recorded = json.load(f)
+    
+    updates = []
+    for index in range(count):
+        update = json.loads(json.dumps(recorded))
+        update["update_id"] += index
+        update["message"]["from"]["id"] += index
+        update["message"]["chat"]["id"] += index
+        updates.append(update)
+    return updates
+
+async def post_all(url: str, secret_token: str, updates: list) -> Counter:
+    """POST every update at the same time and count the response statuses"""
+    async with ClientSession() as session:
+        async def post(update: dict) -> int:
+            async with session.post(url, json=update,
+                                    headers={webhook.SECRET_TOKEN_HEADER: secret_token}) as response:
+                return response.status
+        
+        return Counter(await asyncio.gather(*(post(update) for update in updates)))
+
+async def start_site(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+async def run_in_process(count: int) -> None:
+    # Every 503 logs a warning; the counts below are what matters here
+    logging.getLogger("webhook").setLevel(logging.ERROR)
+    
+    # Stub Bot API answering getMe, which Application.initialize() calls
+    async def bot_api(request: web.Request) -> web.Response:
+        return web.json_response({"ok": True, "result": {
+            "id": 1, "is_bot": True, "first_name": "Benchmark", "username": "benchmark_bot"
+        }})
+    
+    bot_api_app = web.Application()
+    bot_api_app.router.add_post("/bot{token}/{method}", bot_api)
+    bot_api_runner = await start_site(bot_api_app, BOT_API_PORT)
+    
+    handled = 0
+    
+    async def slow_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        nonlocal handled
+        await asyncio.sleep(HANDLER_SECONDS)
+        handled += 1
+    
+    processor = PerChatUpdateProcessor(max_concurrent_updates=2, max_pending_updates=4)
+    application = (
+        Application.builder()
+        .token("1:benchmark")
+        .base_url(f"http://127.0.0.1:{BOT_API_PORT}/bot")
+        .updater(None)
+        .update_queue(asyncio.Queue(maxsize=2))
+        .concurrent_updates(processor)
+        .build()
+    )
+    application.add_handler(TypeHandler(Update, slow_handler))
+    await application.initialize()
+    await application.start()
+    webhook_runner = await start_site(webhook.create_webhook_app(application, SECRET_TOKEN), WEBHOOK_PORT)
+    
+    print(f"{count} updates, handler takes {HANDLER_SECONDS}s, {processor.max_running_updates} running and "
+          f"{processor.max_pending_updates} in flight at most, {webhook.WEBHOOK_ENQUEUE_TIMEOUT}s to wait for a slot")
+    start = time.perf_counter()
+    statuses = await post_all(f"http://127.0.0.1:{WEBHOOK_PORT}{webhook.WEBHOOK_PATH}", SECRET_TOKEN,
+                              make_updates(count))
+    print(f"responses after {time.perf_counter() - start:.1f} s: {dict(sorted(statuses.items()))}, "
+          f"updates in flight {processor.admitted_updates}")
+    
+    while processor.admitted_updates:
+        await asyncio.sleep(0.1)
+    print(f"handled {handled} updates, every accepted one: {handled == statuses[200]}")
+    
+    await webhook_runner.cleanup()
+    await application.stop()
+    await application.shutdown()
+    await bot_api_runner.cleanup()
+
+async def main(count: int, url: str = None) -> None:
+    if url is None:
+        await run_in_process(count)
+        return
+    
+    statuses = await post_all(url, os.getenv("WEBHOOK_SECRET_TOKEN", ""), make_updates(count))
+    print(f"{count} updates to {url}: {dict(sorted(statuses.items()))}")
+
+if __name__ == "__main__":
+    asyncio.run(main(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+        sys.argv[2] if len(sys.argv) > 2 else None
+    ))
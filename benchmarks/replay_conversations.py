@@ -0,0 +1,118 @@
+"""
+Replay harness: thousands of simulated conversations through handle_message with the in-process
+FakeProvider, so the whole reply path (prompt building, history, summaries, persistence) runs
+without network access. Each simulated user sends a message, waits for the reply, and repeats.
+Replies go through the debounce window configured by MESSAGE_DEBOUNCE_SECONDS unless another is given.
+Usage: python benchmarks/replay_conversations.py [conversations] [turns] [latency_seconds] [tokens_per_second]
+       [concurrency] [debounce_seconds]
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conversation_handler
+import metrics
+import rate_limiter
+from character_manager import CharacterManager
+from llm_providers import FakeProvider, set_provider
+from preset_characters import PRESET_CHARACTERS
+from update_processor import PerChatUpdateProcessor
+
+PROMPTS = (
+    "Hello there!", "What do you think about the weather?", "Tell me a story.", "Why is that?",
+    "I had a long day at work.", "What's your favourite book?", "Do you believe in luck?",
+    "That's funny *laughs*", "Can you help me with a riddle?", "Good night!"
+)
+
+class FakeMessage:
+    """Stands in for a telegram Message and records when it was answered"""
+    def __init__(self, text: str):
+        self.text = text
+        self.replied_at = None
+        self.replied = asyncio.Event()
+    
+    async def reply_text(self, text: str, **kwargs) -> "FakeMessage":
+        if self.replied_at is None:
+            self.replied_at = time.perf_counter()
+            self.replied.set()
+        return FakeMessage(text)
+    
+    async def edit_text(self, text: str, **kwargs) -> "FakeMessage":
+        return self
+
+def make_update(user_id: int, text: str) -> SimpleNamespace:
+    """Minimal duck-typed Update for a private chat"""
+    return SimpleNamespace(
+        message=FakeMessage(text),
+        effective_user=SimpleNamespace(id=user_id),
+        effective_chat=SimpleNamespace(id=user_id)
+    )
+
+async def main(conversations: int, turns: int, latency: float, tokens_per_second: float, concurrency: int,
+               debounce: float) -> None:
+    set_provider(FakeProvider(latency=latency, tokens_per_second=tokens_per_second))
+    conversation_handler.MESSAGE_DEBOUNCE_SECONDS = debounce
+    rate_limiter._rate_limiter = rate_limiter.RateLimiter(user_per_minute=0, global_per_second=0)
+    
+    character_manager = CharacterManager()
+    await character_manager.start_write_behind()
+    
+    async def send_chat_action(**kwargs) -> None:
+        pass
+    
+    bot = SimpleNamespace(send_chat_action=send_chat_action)
+    application = SimpleNamespace(create_task=asyncio.create_task)
+    character_ids = list(PRESET_CHARACTERS)
+    processor = PerChatUpdateProcessor(concurrency)
+    latencies = []
+    
+    async def converse(user_id: int) -> None:
+        rng = random.Random(user_id)
+        context = SimpleNamespace(user_data={"selected_character": character_ids[user_id % len(character_ids)]},
+                                  bot_data={"character_manager": character_manager},
+                                  bot=bot, application=application)
+        for turn in range(turns):
+            update = make_update(user_id, f"{rng.choice(PROMPTS)} ({turn})")
+            start = time.perf_counter()
+            await processor.process_update(update, conversation_handler.handle_message(update, context))
+            # A debounced reply is sent by a background task after the update is handled
+            await update.message.replied.wait()
+            latencies.append(update.message.replied_at - start)
+    
+    start = time.perf_counter()
+    await asyncio.gather(*(converse(user_id) for user_id in range(conversations)))
+    elapsed = time.perf_counter() - start
+    await character_manager.stop_write_behind()
+    
+    latencies.sort()
+    total = len(latencies)
+    counters = metrics.snapshot()["counters"]
+    print(f"{conversations} conversations x {turns} turns, fake LLM {latency * 1000:.0f} ms + "
+          f"{tokens_per_second:.0f} tokens/s, concurrency {concurrency}, debounce {debounce}s")
+    print(f"throughput: {total / elapsed:.1f} turns/s over {elapsed:.2f} s")
+    print(f"reply latency p50 {latencies[total // 2] * 1000:.0f} ms, "
+          f"p99 {latencies[int(total * 0.99)] * 1000:.0f} ms")
+    print(f"prompt cache hits {counters.get('prompt_cache_hits', 0):.0f}, "
+          f"misses {counters.get('prompt_cache_misses', 0):.0f}")
+    print(f"user cache hits {counters.get('user_cache_hits', 0):.0f}, "
+          f"misses {counters.get('user_cache_misses', 0):.0f}, "
+          f"evictions {counters.get('user_cache_evictions', 0):.0f}")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as data_root:
+        os.chdir(data_root)
+        asyncio.run(main(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 5,
+            float(sys.argv[3]) if len(sys.argv) > 3 else 0.05,
+            float(sys.argv[4]) if len(sys.argv) > 4 else 500,
+            int(sys.argv[5]) if len(sys.argv) > 5 else 128,
+            float(sys.argv[6]) if len(sys.argv) > 6 else conversation_handler.MESSAGE_DEBOUNCE_SECONDS
+        ))
@@ -1,12 +1,17 @@
+import os
+import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler, CallbackQueryHandler,
-    filters, ContextTypes, ConversationHandler
+    TypeHandler, filters, ContextTypes, ConversationHandler
 )
 
-from character_manager import CharacterManager
+from character_manager import get_character_manager
 from conversation_handler import handle_message
+from mistral_integration import start_client, close_client
+from metrics import start_loop_lag_monitor, stop_loop_lag_monitor
+from update_processor import PerChatUpdateProcessor
 from utils import (
     handle_error, list_characters, show_current_character, 
     reset_conversation, show_character_stats, create_character_start,
@@ -16,13 +21,25 @@ from utils import (
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of received updates waiting to be processed
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+
 def setup_bot(token: str) -> Application:
     """Set up the Telegram bot with all handlers"""
-    # Initialize the character manager
-    character_manager = CharacterManager()
+    # Initialize the character manager once; handlers share it through bot_data
+    character_manager = get_character_manager()
     
-    # Create the Application instance
-    application = Application.builder().token(token).build()
+    # Create the Application instance, handling different chats concurrently
+    application = (
+        Application.builder()
+        .token(token)
+        .update_queue(asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE))
+        .concurrent_updates(PerChatUpdateProcessor())
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .build()
+    )
+    application.bot_data["character_manager"] = character_manager
     
     # Add conversation handler for character creation
     creation_conv_handler = ConversationHandler(
@@ -35,6 +52,9 @@ def setup_bot(token: str) -> Application:
         fallbacks=[CommandHandler("cancel", cancel_creation)],
     )
     
+    # Read the user's data from storage before any handler touches it, so a cache miss doesn't block the loop
+    application.add_handler(TypeHandler(Update, prefetch_user_data), group=-1)
+    
     # Register command handlers
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
@@ -59,6 +79,27 @@ def setup_bot(token: str) -> Application:
     
     return application
 
+async def _post_init(application: Application) -> None:
+    """Start background work once the application is initialized"""
+    await application.bot_data["character_manager"].start_write_behind()
+    await start_client()
+    start_loop_lag_monitor()
+
+async def _post_shutdown(application: Application) -> None:
+    """Flush pending user data and close connections when the application shuts down"""
+    await stop_loop_lag_monitor()
+    await close_client()
+    character_manager = application.bot_data["character_manager"]
+    await character_manager.stop_write_behind()
+    # Wait for memories still being appended so none are lost
+    if character_manager.memory_store is not None:
+        character_manager.memory_store.close()
+
+async def prefetch_user_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Load the sender's data into the user cache off the event loop"""
+    if update.effective_user is not None:
+        await context.bot_data["character_manager"].prefetch_user(update.effective_user.id)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Send welcome message when the command /start is issued."""
     user = update.effective_user
@@ -121,7 +162,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     
     if query.data == "show_characters":
         # Create a new message instead of trying to update
-        character_manager = CharacterManager()
+        character_manager = context.bot_data["character_manager"]
         
         # Get all characters
         all_characters = character_manager.get_all_characters()
@@ -222,7 +263,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         context.user_data["selected_character"] = character_id
         
         # Get character details from character manager
-        character_manager = CharacterManager()
+        character_manager = context.bot_data["character_manager"]
         character = character_manager.get_character(character_id)
         character_manager.set_user_selected_character(update.effective_user.id, character_id)
         
@@ -1,61 +1,353 @@
 import os
-import json
+import copy
+import uuid
+import asyncio
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Set, Tuple
 from preset_characters import PRESET_CHARACTERS
+from conversation_history import ConversationHistory, Message
+from data_storage import AsyncUserStore, MutationJournal, UserCache, create_user_store, load_json_file, save_json_file
+from memory_index import create_memory_store
+from mistral_integration import invalidate_prompt_cache
+from token_budget import HISTORY_TOKEN_BUDGET, estimate_tokens, history_window_start
 
 logger = logging.getLogger(__name__)
 
+# Maximum number of messages kept per conversation; their tokens are further limited by HISTORY_TOKEN_BUDGET
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "100"))
+
+# Maximum number of evicted messages kept waiting for summarisation per conversation
+MAX_PENDING_SUMMARY_MESSAGES = 200
+
 class CharacterManager:
     """
     Manages character profiles, including preset and custom characters.
     Handles character selection, creation, deletion, and stats tracking.
     """
-    def __init__(self):
+    def __init__(self, user_store=None, flush_interval: Optional[float] = None,
+                 flush_max_dirty: Optional[int] = None):
         self.data_dir = "data"
         self.custom_characters_file = os.path.join(self.data_dir, "custom_characters.json")
-        self.user_data_file = os.path.join(self.data_dir, "user_data.json")
         self.preset_characters = PRESET_CHARACTERS
         
         # Create data directory if it doesn't exist
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
         
-        # Load custom characters and user data
+        # Storage backend for user data (per-user files unless configured otherwise)
+        self.user_store = user_store or create_user_store(self.data_dir)
+        
+        # Load custom characters; users are loaded as they're used and the least recently used
+        # are evicted once their changes are stored
+        self._custom_characters_mtime: Optional[float] = None
         self.custom_characters = self._load_custom_characters()
+        self._flushing_users: Set[str] = set()
+        # Users kept in the cache while a reply to them is pending, with the number of such replies
+        self._pinned_users: Dict[str, int] = {}
         self.user_data = self._load_user_data()
+        
+        # Write-behind state: users whose data changed since the last flush.
+        # Until start_write_behind() is called every change is saved immediately.
+        self.flush_interval = flush_interval if flush_interval is not None else \
+            float(os.getenv("PERSIST_FLUSH_INTERVAL", "2.0"))
+        self.flush_max_dirty = flush_max_dirty if flush_max_dirty is not None else \
+            int(os.getenv("PERSIST_FLUSH_MAX_DIRTY", "100"))
+        self._dirty_users: Set[str] = set()
+        # Individual changes (new messages, resets) for stores that record them as rows
+        self._records_mutations = getattr(self.user_store, "records_messages", False)
+        self._pending_mutations: Dict[str, List[List[Any]]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._flush_requested: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._stopping_write_behind = False
+        self._custom_characters_dirty = False
+        # Async interface to the user store used while write-behind is running
+        self.async_store: Optional[AsyncUserStore] = None
+        
+        # Journal of changes not yet flushed, replayed if the bot stops before a flush
+        self.journal_enabled = os.getenv("PERSIST_JOURNAL", "true").lower() == "true"
+        self.journal_fsync = os.getenv("PERSIST_JOURNAL_FSYNC", "false").lower() == "true"
+        self._journal: Optional[MutationJournal] = None
+        # Users whose full record is in the current journal segment; their later changes journal only the change
+        self._journaled_users: Set[str] = set()
+        
+        # Long-term memories of messages evicted from the history (None without numpy)
+        self.memory_store = create_memory_store(self.data_dir)
     
     def _load_custom_characters(self) -> Dict[str, Dict]:
         """Load custom characters from file or create empty dict if file doesn't exist"""
         if os.path.exists(self.custom_characters_file):
-            try:
-                with open(self.custom_characters_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error decoding custom characters file. Creating new file.")
-                return {}
+            self._custom_characters_mtime = os.path.getmtime(self.custom_characters_file)
+            return load_json_file(self.custom_characters_file)
         return {}
     
-    def _load_user_data(self) -> Dict[str, Dict]:
-        """Load user data from file or create empty dict if file doesn't exist"""
-        if os.path.exists(self.user_data_file):
+    def _load_user_data(self) -> UserCache:
+        """Set up the cache of user data, which reads users from the user store on first use"""
+        return UserCache(self.user_store, prepare=self._compact_histories, can_evict=self._can_evict_user)
+    
+    def _can_evict_user(self, user_id: str) -> bool:
+        """Users can only be evicted once their changes are stored and no reply to them is pending"""
+        return (user_id not in self._dirty_users and user_id not in self._flushing_users
+                and user_id not in self._pinned_users)
+    
+    def pin_user(self, user_id: int) -> None:
+        """Keep a user in the cache until unpin_user(), so a pending reply doesn't reload them on the event loop"""
+        user_id = str(user_id)
+        self._pinned_users[user_id] = self._pinned_users.get(user_id, 0) + 1
+    
+    def unpin_user(self, user_id: int) -> None:
+        """Undo one pin_user() call; the user can be evicted again once every pin is undone"""
+        user_id = str(user_id)
+        count = self._pinned_users.get(user_id, 0) - 1
+        if count > 0:
+            self._pinned_users[user_id] = count
+        else:
+            self._pinned_users.pop(user_id, None)
+    
+    async def prefetch_user(self, user_id: int) -> None:
+        """Read a user from the store off the event loop, so handling their update doesn't block on it"""
+        if self.async_store is None or self.user_data.is_resident(str(user_id)):
+            return
+        record = await self.async_store.load_user(str(user_id))
+        self.user_data.add_loaded(str(user_id), record)
+    
+    def _records_to_save(self, user_ids: List[str]) -> Dict[str, Dict]:
+        """The records a save of the given users needs: every user's for stores that rewrite them all"""
+        if getattr(self.user_store, "rewrites_all_users", False):
+            return dict(self.user_data.items())
+        records = {user_id: self.user_data.peek(user_id) for user_id in user_ids}
+        return {user_id: record for user_id, record in records.items() if record is not None}
+    
+    def _compact_histories(self, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn the loaded message lists of a user record into ring buffers of message records"""
+        histories = record.get("conversation_history", {})
+        for character_id, history in histories.items():
+            if isinstance(history, ConversationHistory):
+                continue
+            
+            # Messages beyond the limits (if they were lowered) are queued for the summary, as if just evicted
+            start = max(len(history) - HISTORY_MAX_MESSAGES, history_window_start(history, HISTORY_TOKEN_BUDGET))
+            if start > 0:
+                summary = record.setdefault("conversation_summaries", {}) \
+                    .setdefault(character_id, {"text": "", "pending": []})
+                summary["pending"].extend({"role": m["role"], "content": m["content"]} for m in history[:start])
+                del summary["pending"][:-MAX_PENDING_SUMMARY_MESSAGES]
+            histories[character_id] = ConversationHistory(history[start:], HISTORY_MAX_MESSAGES)
+        return record
+    
+    def _save_custom_characters(self, character_id: str) -> None:
+        """
+        Save custom characters to file after one of them changed, or journal the change
+        and have the background task save them soon
+        """
+        if self._flush_task is not None:
+            self._custom_characters_dirty = True
+            if self._journal is not None:
+                self._journal.append(None, None, ["custom_character", character_id,
+                                                  self.custom_characters.get(character_id)])
+            self._flush_requested.set()
+            return
+        
+        self._write_custom_characters()
+    
+    def _write_custom_characters(self) -> None:
+        """Write custom characters to file"""
+        if not save_json_file(self.custom_characters_file, self.custom_characters):
+            raise IOError(f"Failed to save custom characters to {self.custom_characters_file}")
+        self._custom_characters_mtime = os.path.getmtime(self.custom_characters_file)
+    
+    def _save_user_data(self, user_id: int, mutation: Optional[List[Any]] = None) -> None:
+        """
+        Save the data of a single user, or mark it dirty if write-behind is running.
+        The mutation describes the change for stores that record individual changes,
+        e.g. ["append", character_id, role, content, tokens, id], ["reset", character_id, id] or
+        ["stats", character_id, stats]; it is also what the journal records instead of the full record.
+        The id lets stores that record changes as rows skip a change already stored when the journal is replayed.
+        """
+        if mutation is not None and self._records_mutations:
+            self._pending_mutations.setdefault(str(user_id), []).append(mutation)
+        
+        if self._flush_task is None:
+            mutations = {}
+            if str(user_id) in self._pending_mutations:
+                mutations[str(user_id)] = self._pending_mutations.pop(str(user_id))
+            if not self.user_store.save(self._records_to_save([str(user_id)]), [str(user_id)], mutations):
+                self._finish_flush([str(user_id)], mutations, False, None)
+            return
+        
+        self._dirty_users.add(str(user_id))
+        if self._journal is not None:
+            # A user's first change in a segment journals their whole record, later changes only the change
+            # itself, so a chat turn doesn't serialize the whole history on the event loop
+            if mutation is not None and str(user_id) in self._journaled_users:
+                self._journal.append(str(user_id), None, mutation)
+            else:
+                self._journal.append(str(user_id), self.user_data[str(user_id)], mutation)
+                self._journaled_users.add(str(user_id))
+        if len(self._dirty_users) >= self.flush_max_dirty:
+            self._flush_requested.set()
+    
+    def _take_dirty_snapshot(self) -> Tuple[List[str], Dict[str, Dict], Dict[str, List], Optional[int]]:
+        """
+        Take the dirty users, a copy of their data that is safe to write from another thread
+        and their pending mutations. Also rotates the journal and returns the segment that
+        the snapshot covers.
+        """
+        user_ids = list(self._dirty_users)
+        self._dirty_users.clear()
+        if not user_ids:
+            return user_ids, {}, {}, None
+        
+        mutations = {user_id: self._pending_mutations.pop(user_id)
+                     for user_id in user_ids if user_id in self._pending_mutations}
+        segment = self._journal.rotate() if self._journal is not None else None
+        self._journaled_users.clear()
+        # The users stay in memory until the flush is done, a reload before then would miss their changes
+        self._flushing_users.update(user_ids)
+        return user_ids, copy.deepcopy(self._records_to_save(user_ids)), mutations, segment
+    
+    def _finish_flush(self, user_ids: List[str], mutations: Dict[str, List],
+                      saved: bool, segment: Optional[int]) -> None:
+        """
+        Drop the journal segments covered by a successful flush, or keep the users dirty.
+        Users that are clean now can be evicted from memory.
+        """
+        self._flushing_users.difference_update(user_ids)
+        if not saved:
+            # Keep the users dirty, with their mutations first in line, so the next flush retries them
+            logger.error(f"Failed to flush data for {len(user_ids)} users, will retry")
+            self._dirty_users.update(user_ids)
+            for user_id, user_mutations in mutations.items():
+                self._pending_mutations[user_id] = user_mutations + self._pending_mutations.get(user_id, [])
+        elif segment is not None and not self._custom_characters_dirty:
+            # Custom character changes still waiting to be written keep their journal entries too
+            self._journal.discard_through(segment)
+        self.user_data.evict()
+    
+    def flush(self) -> None:
+        """Synchronously write every dirty user to the user store"""
+        if self._custom_characters_dirty:
+            self._custom_characters_dirty = False
+            self._write_custom_characters()
+        
+        user_ids, snapshot, mutations, segment = self._take_dirty_snapshot()
+        if user_ids:
+            saved = self.user_store.save(snapshot, user_ids, mutations)
+            self._finish_flush(user_ids, mutations, saved, segment)
+    
+    async def flush_async(self) -> None:
+        """Write every dirty user to the user store without blocking the event loop"""
+        async with self._flush_lock:
+            if self._custom_characters_dirty:
+                self._custom_characters_dirty = False
+                custom_characters = copy.deepcopy(self.custom_characters)
+                if await self.async_store.save_json_file(self.custom_characters_file, custom_characters):
+                    self._custom_characters_mtime = os.path.getmtime(self.custom_characters_file)
+                else:
+                    self._custom_characters_dirty = True
+            
+            user_ids, snapshot, mutations, segment = self._take_dirty_snapshot()
+            if not user_ids:
+                return
+            
+            saved = await self.async_store.save(snapshot, user_ids, mutations)
+            self._finish_flush(user_ids, mutations, saved, segment)
+    
+    async def _flush_periodically(self) -> None:
+        """Flush dirty users every flush_interval seconds, or sooner when too many are dirty"""
+        while not self._stopping_write_behind:
             try:
-                with open(self.user_data_file, 'r') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                logger.error("Error decoding user data file. Creating new file.")
-                return {}
-        return {}
+                await asyncio.wait_for(self._flush_requested.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            
+            try:
+                await self.flush_async()
+            except Exception as e:
+                logger.error(f"Error flushing user data: {str(e)}")
+    
+    async def start_write_behind(self) -> None:
+        """Start coalescing user data saves and flushing them from a background task"""
+        if self._flush_task is not None:
+            return
+        
+        if self.journal_enabled:
+            self._journal = MutationJournal(self.data_dir, fsync=self.journal_fsync)
+            self._replay_journal()
+        
+        self.async_store = AsyncUserStore(self.user_store)
+        self._flush_requested = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._stopping_write_behind = False
+        self._flush_task = asyncio.create_task(self._flush_periodically())
     
-    def _save_custom_characters(self) -> None:
-        """Save custom characters to file"""
-        with open(self.custom_characters_file, 'w') as f:
-            json.dump(self.custom_characters, f, indent=2)
+    async def stop_write_behind(self) -> None:
+        """Stop the background flush task and write any remaining dirty users"""
+        if self._flush_task is None:
+            return
+        
+        # Let the task finish rather than cancelling it: a cancelled flush would leave its write running
+        # in the storage thread, where it could land after the final flush and overwrite newer data
+        self._stopping_write_behind = True
+        self._flush_requested.set()
+        await self._flush_task
+        
+        await self.flush_async()
+        self._flush_task = None
+        self.async_store.close()
+        self.async_store = None
+        
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
     
-    def _save_user_data(self) -> None:
-        """Save user data to file"""
-        with open(self.user_data_file, 'w') as f:
-            json.dump(self.user_data, f, indent=2)
+    def _replay_journal(self) -> None:
+        """Apply changes left in the journal by a previous run and store them"""
+        replayed_users = set()
+        for user_id, record, mutation in self._journal.replay():
+            # Custom character changes aren't tied to a user; the character is journaled as it was after the change
+            if user_id is None:
+                _, character_id, character = mutation
+                if character is None:
+                    self.custom_characters.pop(character_id, None)
+                else:
+                    self.custom_characters[character_id] = character
+                self._custom_characters_dirty = True
+                continue
+            
+            if record is None and user_id not in replayed_users:
+                logger.warning(f"Skipping journaled change of user {user_id} without their record")
+                continue
+            
+            # Marked dirty right away so the record isn't evicted before it's stored
+            self._dirty_users.add(user_id)
+            if record is not None:
+                self.user_data[user_id] = self._compact_histories(record)
+            else:
+                self._replay_mutation(user_id, mutation)
+            replayed_users.add(user_id)
+            if mutation is not None and self._records_mutations:
+                self._pending_mutations.setdefault(user_id, []).append(mutation)
+        
+        if replayed_users or self._custom_characters_dirty:
+            logger.info(f"Replayed unflushed changes for {len(replayed_users)} users from the journal")
+            self.flush()
+    
+    def _replay_mutation(self, user_id: str, mutation: List[Any]) -> None:
+        """Apply a journaled change to the record of a user"""
+        if mutation[0] == "append":
+            _, character_id, role, content, tokens = mutation[:5]
+            self._push_message(user_id, character_id, Message(role, content, tokens))
+        elif mutation[0] == "reset":
+            _, character_id = mutation[:2]
+            self.user_data[user_id].get("conversation_history", {}).pop(character_id, None)
+            self.user_data[user_id].get("conversation_summaries", {}).pop(character_id, None)
+        elif mutation[0] == "stats":
+            _, character_id, stats = mutation
+            self.user_data[user_id].setdefault("character_stats", {})[character_id] = stats
+        else:
+            logger.warning(f"Skipping unknown journaled change {mutation[0]!r} of user {user_id}")
     
     def get_all_characters(self) -> Dict[str, Dict]:
         """Get all characters (preset + custom)"""
@@ -72,7 +364,7 @@ class CharacterManager:
         """Get the custom characters created by a user"""
         if str(user_id) not in self.user_data:
             self.user_data[str(user_id)] = {"custom_characters": []}
-            self._save_user_data()
+            self._save_user_data(user_id)
         
         return self.user_data[str(user_id)].get("custom_characters", [])
     
@@ -80,7 +372,7 @@ class CharacterManager:
         """Get the currently selected character for a user"""
         if str(user_id) not in self.user_data:
             self.user_data[str(user_id)] = {"selected_character": None}
-            self._save_user_data()
+            self._save_user_data(user_id)
         
         return self.user_data[str(user_id)].get("selected_character")
     
@@ -110,7 +402,7 @@ class CharacterManager:
                     }
                 }
         
-        self._save_user_data()
+        self._save_user_data(user_id)
     
     def create_custom_character(self, user_id: int, name: str, description: str, 
                                 traits: Dict[str, int], system_prompt: str, nsfw: bool = False) -> str:
@@ -128,9 +420,14 @@ class CharacterManager:
             "nsfw": nsfw
         }
         
+        # Recreating a character under the same ID bumps its version so cached prompts aren't reused
+        if character_id in self.custom_characters:
+            character["version"] = self.custom_characters[character_id].get("version", 0) + 1
+            invalidate_prompt_cache(character_id)
+        
         # Add the character to custom characters
         self.custom_characters[character_id] = character
-        self._save_custom_characters()
+        self._save_custom_characters(character_id)
         
         # Add the character to the user's custom characters
         if str(user_id) not in self.user_data:
@@ -140,7 +437,7 @@ class CharacterManager:
             self.user_data[str(user_id)]["custom_characters"] = []
         
         self.user_data[str(user_id)]["custom_characters"].append(character_id)
-        self._save_user_data()
+        self._save_user_data(user_id)
         
         return character_id
     
@@ -149,7 +446,8 @@ class CharacterManager:
         if character_id in self.custom_characters and self.custom_characters[character_id]["creator_id"] == user_id:
             # Remove from custom characters
             del self.custom_characters[character_id]
-            self._save_custom_characters()
+            self._save_custom_characters(character_id)
+            invalidate_prompt_cache(character_id)
             
             # Remove from user's custom characters
             if str(user_id) in self.user_data and "custom_characters" in self.user_data[str(user_id)]:
@@ -160,7 +458,7 @@ class CharacterManager:
                 if self.user_data[str(user_id)].get("selected_character") == character_id:
                     self.user_data[str(user_id)]["selected_character"] = None
                 
-                self._save_user_data()
+                self._save_user_data(user_id)
             
             return True
         
@@ -208,52 +506,92 @@ class CharacterManager:
                 if trait in character_stats["personality_stats"]:
                     character_stats["personality_stats"][trait] = max(1, min(10, value))
         
-        self._save_user_data()
+        self._save_user_data(user_id, ["stats", character_id, character_stats])
     
     def reset_conversation(self, user_id: int, character_id: str) -> None:
         """Reset the conversation with a character"""
         if str(user_id) in self.user_data and "conversation_history" in self.user_data[str(user_id)]:
             if character_id in self.user_data[str(user_id)]["conversation_history"]:
-                self.user_data[str(user_id)]["conversation_history"][character_id] = []
-                self._save_user_data()
+                self.user_data[str(user_id)]["conversation_history"][character_id] = \
+                    ConversationHistory(maxlen=HISTORY_MAX_MESSAGES)
+                self.user_data[str(user_id)].get("conversation_summaries", {}).pop(character_id, None)
+                if self.memory_store is not None:
+                    self.memory_store.forget(user_id, character_id)
+                self._save_user_data(user_id, ["reset", character_id, uuid.uuid4().hex])
     
-    def get_conversation_history(self, user_id: int, character_id: str) -> List[Dict]:
+    def get_conversation_history(self, user_id: int, character_id: str) -> ConversationHistory:
         """Get the conversation history with a character"""
         if str(user_id) not in self.user_data:
             self.user_data[str(user_id)] = {"conversation_history": {}}
         
-        if "conversation_history" not in self.user_data[str(user_id)]:
-            self.user_data[str(user_id)]["conversation_history"] = {}
+        histories = self.user_data[str(user_id)].setdefault("conversation_history", {})
+        if character_id not in histories:
+            histories[character_id] = ConversationHistory(maxlen=HISTORY_MAX_MESSAGES)
         
-        if character_id not in self.user_data[str(user_id)]["conversation_history"]:
-            self.user_data[str(user_id)]["conversation_history"][character_id] = []
-        
-        return self.user_data[str(user_id)]["conversation_history"][character_id]
+        return histories[character_id]
     
     def add_to_conversation_history(self, user_id: int, character_id: str, role: str, content: str) -> None:
         """Add a message to the conversation history"""
-        if str(user_id) not in self.user_data:
-            self.user_data[str(user_id)] = {"conversation_history": {}}
-        
-        if "conversation_history" not in self.user_data[str(user_id)]:
-            self.user_data[str(user_id)]["conversation_history"] = {}
-        
-        if character_id not in self.user_data[str(user_id)]["conversation_history"]:
-            self.user_data[str(user_id)]["conversation_history"][character_id] = []
-        
-        # Add the message to the conversation history
-        self.user_data[str(user_id)]["conversation_history"][character_id].append({
-            "role": role,
-            "content": content
-        })
+        # Add the message to the conversation history, with its token estimate so prompts
+        # can be fitted to the token budget without measuring the whole history again.
+        message_tokens = estimate_tokens(content)
+        evicted = self._push_message(user_id, character_id, Message(role, content, message_tokens))
         
-        # Limit the conversation history to the last 30 messages for better memory while avoiding context length issues
-        if len(self.user_data[str(user_id)]["conversation_history"][character_id]) > 30:
-            self.user_data[str(user_id)]["conversation_history"][character_id] = \
-                self.user_data[str(user_id)]["conversation_history"][character_id][-30:]
-        
-        self._save_user_data()
+        # Evicted messages are also kept as long-term memories that can be recalled when relevant
+        if evicted and self.memory_store is not None:
+            self.memory_store.add(user_id, character_id, evicted)
         
+        self._save_user_data(user_id, ["append", character_id, role, content, message_tokens, uuid.uuid4().hex])
+    
+    def _push_message(self, user_id: int, character_id: str, message: Message) -> List[Message]:
+        """
+        Append a message to a conversation and return the messages it evicted, which are queued
+        to be folded into the conversation summary. The history keeps what fits in
+        HISTORY_TOKEN_BUDGET, at most HISTORY_MAX_MESSAGES messages.
+        """
+        history = self.get_conversation_history(user_id, character_id)
+        evicted = history.push(message)
+        evicted = ([evicted] if evicted is not None else []) + history.trim_to_tokens(HISTORY_TOKEN_BUDGET)
+        
+        if evicted:
+            summary = self._get_summary_record(user_id, character_id)
+            summary["pending"].extend({"role": m.role, "content": m.content} for m in evicted)
+            del summary["pending"][:-MAX_PENDING_SUMMARY_MESSAGES]
+        return evicted
+        
+    def _get_summary_record(self, user_id: int, character_id: str) -> Dict[str, Any]:
+        """Get the summary record of a conversation, creating it if it doesn't exist"""
+        summaries = self.user_data[str(user_id)].setdefault("conversation_summaries", {})
+        return summaries.setdefault(character_id, {"text": "", "pending": []})
+    
+    def get_conversation_summary(self, user_id: int, character_id: str) -> Optional[str]:
+        """Get the running summary of the evicted part of a conversation, if any"""
+        summary = self.user_data.get(str(user_id), {}).get("conversation_summaries", {}).get(character_id)
+        if summary and summary["text"]:
+            return summary["text"]
+        return None
+    
+    def get_pending_summary_messages(self, user_id: int, character_id: str) -> List[Dict]:
+        """Get the evicted messages that are not part of the conversation summary yet"""
+        summary = self.user_data.get(str(user_id), {}).get("conversation_summaries", {}).get(character_id)
+        return list(summary["pending"]) if summary else []
+    
+    def apply_conversation_summary(self, user_id: int, character_id: str,
+                                   summary_text: str, summarized_messages: List[Dict]) -> bool:
+        """
+        Store a new conversation summary that covers the given pending messages.
+        Returns False, leaving the summary unchanged, if the conversation was reset
+        or the pending messages changed since they were read.
+        """
+        summary = self.user_data.get(str(user_id), {}).get("conversation_summaries", {}).get(character_id)
+        if not summary or summary["pending"][:len(summarized_messages)] != summarized_messages:
+            return False
+        
+        summary["text"] = summary_text
+        del summary["pending"][:len(summarized_messages)]
+        self._save_user_data(user_id)
+        return True
+    
     def toggle_nsfw_mode(self, character_id: str) -> bool:
         """
         Toggle NSFW mode for a character
@@ -272,12 +610,45 @@ class CharacterManager:
             if character_id.startswith("custom_"):
                 if character_id in self.custom_characters:
                     self.custom_characters[character_id]["nsfw"] = new_nsfw_status
-                    self._save_custom_characters()
+                    self._save_custom_characters(character_id)
             else:
                 # For preset characters, we need to modify them in-memory
                 # since PRESET_CHARACTERS is a constant
                 self.preset_characters[character_id]["nsfw"] = new_nsfw_status
             
+            invalidate_prompt_cache(character_id)
             return new_nsfw_status
             
         return False
+
+    def reload_custom_characters(self) -> bool:
+        """
+        Reload custom characters if the file was changed by another process
+        Returns True if the in-memory characters were refreshed
+        """
+        try:
+            mtime = os.path.getmtime(self.custom_characters_file)
+        except OSError:
+            return False
+        
+        if mtime == self._custom_characters_mtime:
+            return False
+        
+        old_characters = self.custom_characters
+        self.custom_characters = self._load_custom_characters()
+        
+        # Characters edited by the other process may have kept their version
+        for character_id in set(old_characters) | set(self.custom_characters):
+            if old_characters.get(character_id) != self.custom_characters.get(character_id):
+                invalidate_prompt_cache(character_id)
+        return True
+
+# The process-wide manager, created on first use and shared by every handler
+_shared_character_manager: Optional[CharacterManager] = None
+
+def get_character_manager() -> CharacterManager:
+    """Get the process-wide character manager, loading its state on first use"""
+    global _shared_character_manager
+    if _shared_character_manager is None:
+        _shared_character_manager = CharacterManager()
+    return _shared_character_manager
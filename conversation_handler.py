@@ -1,72 +1,88 @@
-import logging
+import os
 import re
-from telegram import Update
+import time
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from telegram import Message, Update
+from telegram.error import RetryAfter, TelegramError
 from telegram.ext import ContextTypes
-from character_manager import CharacterManager
-from mistral_integration import generate_response
+from mistral_integration import (
+    MistralUnavailableError, calculate_mood_change, generate_response, generate_response_stream
+)
+from metrics import increment
+from rate_limiter import get_rate_limiter
+from summarizer import needs_summary, update_conversation_summary
 
 logger = logging.getLogger(__name__)
 
+# Stream replies into Telegram while they are generated instead of waiting for the full text
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "false").lower() == "true"
+# Minimum seconds between edits of a streamed message
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Seconds to wait for more messages once a user sends a second message within this many seconds of the previous
+# one, so a burst gets one reply (0 never waits)
+MESSAGE_DEBOUNCE_SECONDS = float(os.getenv("MESSAGE_DEBOUNCE_SECONDS", "1.5"))
+# Seconds a lone message waits before its reply starts, so the next message of a burst joins it instead of
+# cancelling an upstream request already under way (at most MESSAGE_DEBOUNCE_SECONDS)
+MESSAGE_GRACE_SECONDS = float(os.getenv("MESSAGE_GRACE_SECONDS", "0.5"))
+# Cancel a reply still being generated when the user sends a newer message; the next reply covers both
+CANCEL_ON_NEW_MESSAGE = os.getenv("CANCEL_ON_NEW_MESSAGE", "true").lower() == "true"
+
+# Replies waiting out the debounce window and replies being generated, per (user, character)
+_waiting_replies: Dict[Tuple[int, str], asyncio.Task] = {}
+_generating_replies: Dict[Tuple[int, str], asyncio.Task] = {}
+# When each (user, character) last received a message, oldest first; only those within the debounce window are kept
+_last_message_times: "OrderedDict[Tuple[int, str], float]" = OrderedDict()
+
+# Expressions in asterisks like *sigh* or *blushes*, or common emotional sounds like "ahh", "umm", "hmm".
+# One alternation scanned left to right, so overlapping matches (e.g. "sigh" inside "*sigh*")
+# resolve to the leftmost, asterisk-delimited expression.
+_EMOTIONAL_SOUNDS = (
+    r'a+h+', r'u+m+', r'h+m+', r'o+h+', r'w+o+w+', r'h+u+h+', r'e+h+', r'u+h+',
+    r'h+a+h+a+', r'h+e+h+e+', r't+s+k+', r's+i+g+h+', r'a+w+w+', r'o+o+p+s+',
+    r'y+a+y+', r'w+h+e+w+', r'p+f+f+t+', r'e+e+k+', r'a+c+k+', r'h+m+p+h+',
+    r'e+r+m+', r'w+e+l+l+'
+)
+_EXPRESSION_PATTERN = re.compile(
+    r'\*(?P<action>.*?)\*|\b(?P<sound>' + '|'.join(_EMOTIONAL_SOUNDS) + r')\b',
+    flags=re.IGNORECASE
+)
+
+# The characters that need escaping in MarkdownV2 text are: \_*[]()~`>#+-=|{}.!
+_MARKDOWN_V2_ESCAPES = str.maketrans({c: f'\\{c}' for c in '\\_*[]()~`>#+-=|{}.!'})
+# Inside code entities only ` and \ need escaping
+_MARKDOWN_V2_CODE_ESCAPES = str.maketrans({c: f'\\{c}' for c in '\\`'})
+
 def format_emotional_expressions(text):
     """
     Format emotional expressions like *sigh*, *hmph*, etc. with monospace formatting
     Also handles expressions like "ahh", "umm", "hmm", etc.
     Properly escapes special characters for Telegram's MarkdownV2
     """
-    # First, we'll collect all the sections we want to format as monospace
-    monospace_sections = []
-    
-    # Pattern for expressions in asterisks like *sigh* or *blushes*
-    asterisk_pattern = r'\*(.*?)\*'
-    for match in re.finditer(asterisk_pattern, text):
-        monospace_sections.append((match.start(), match.end(), match.group(1)))
-    
-    # Pattern for common emotional expressions like "ahh", "umm", "hmm", etc.
-    # These are usually at the beginning of a sentence or standalone
-    emotional_sounds = [
-        r'\b(a+h+)\b', r'\b(u+m+)\b', r'\b(h+m+)\b', r'\b(o+h+)\b', 
-        r'\b(w+o+w+)\b', r'\b(h+u+h+)\b', r'\b(e+h+)\b', r'\b(u+h+)\b',
-        r'\b(h+a+h+a+)\b', r'\b(h+e+h+e+)\b', r'\b(t+s+k+)\b', r'\b(s+i+g+h+)\b',
-        r'\b(a+w+w+)\b', r'\b(o+o+p+s+)\b', r'\b(y+a+y+)\b', r'\b(w+h+e+w+)\b',
-        r'\b(p+f+f+t+)\b', r'\b(e+e+k+)\b', r'\b(a+c+k+)\b', r'\b(h+m+p+h+)\b',
-        r'\b(e+r+m+)\b', r'\b(w+e+l+l+)\b'
-    ]
-    
-    for pattern in emotional_sounds:
-        for match in re.finditer(pattern, text, flags=re.IGNORECASE):
-            monospace_sections.append((match.start(), match.end(), match.group(1)))
-    
-    # Sort the sections by start position
-    monospace_sections.sort(key=lambda x: x[0])
-    
-    # If no sections were found, return the original text
-    if not monospace_sections:
-        return text
-    
-    # Now we need to escape special characters required by MarkdownV2
-    # The characters that need escaping are: _*[]()~`>#+-=|{}.!
-    special_chars = r'_*[]()~`>#+-=|{}.!'
-    escape_chars = lambda s: ''.join([f'\\{c}' if c in special_chars else c for c in s])
-    
-    # Build the resulting text with proper escaping and formatting
-    result = ""
+    parts = []
     last_end = 0
     
-    for start, end, content in monospace_sections:
-        # Add escaped text before this monospace section
-        result += escape_chars(text[last_end:start])
+    for match in _EXPRESSION_PATTERN.finditer(text):
+        content = match.group('action') if match.group('sound') is None else match.group('sound')
+        if not content:
+            # "**" has nothing to format, keep it as escaped text
+            continue
         
-        # Add the monospace section without escaping inside the backticks
-        # For MarkdownV2, backticks themselves don't need to be escaped when they're used for code formatting
-        result += f'`{content}`'
-        
-        last_end = end
+        # Escaped text before this expression, then the expression as monospace
+        parts.append(text[last_end:match.start()].translate(_MARKDOWN_V2_ESCAPES))
+        parts.append(f'`{content.translate(_MARKDOWN_V2_CODE_ESCAPES)}`')
+        last_end = match.end()
     
-    # Add any remaining text after the last monospace section
-    if last_end < len(text):
-        result += escape_chars(text[last_end:])
+    # If no expressions were found, return the original text
+    if not parts:
+        return text
     
-    return result
+    # Add any remaining text after the last expression
+    parts.append(text[last_end:].translate(_MARKDOWN_V2_ESCAPES))
+    return ''.join(parts)
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle normal messages and generate a response from the character"""
@@ -81,8 +97,9 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Don't respond with character since the user is in creation mode
         return
     
-    # Get the character manager
-    character_manager = CharacterManager()
+    # Get the character manager, with the user's data read from storage if it isn't in memory
+    character_manager = context.bot_data["character_manager"]
+    await character_manager.prefetch_user(user_id)
     
     # Get the user's selected character
     selected_character_id = context.user_data.get("selected_character") or character_manager.get_user_selected_character(user_id)
@@ -112,8 +129,121 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Add the user message to the conversation history
     character_manager.add_to_conversation_history(user_id, selected_character_id, "user", user_message)
     
-    # Get the conversation history
+    if MESSAGE_DEBOUNCE_SECONDS > 0:
+        # Answer a burst of messages with one reply; the wait runs outside this chat's update processing
+        _schedule_reply(update, context, character_manager, user_id, selected_character_id, character)
+    else:
+        # Keep the user cached while the reply is generated
+        character_manager.pin_user(user_id)
+        try:
+            await _reply(update, context, character_manager, user_id, selected_character_id, character)
+        finally:
+            character_manager.unpin_user(user_id)
+
+def _schedule_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, character_manager, user_id: int,
+                    character_id: str, character: Dict) -> None:
+    """Reply after a short grace period, or after the debounce window if the previous message arrived within it"""
+    key = (user_id, character_id)
+    waiting = _waiting_replies.get(key)
+    
+    # Only a second message within the window starts the full wait, so lone messages are barely delayed
+    now = time.monotonic()
+    while _last_message_times and next(iter(_last_message_times.values())) < now - MESSAGE_DEBOUNCE_SECONDS:
+        _last_message_times.popitem(last=False)
+    in_burst = key in _last_message_times or waiting is not None
+    _last_message_times[key] = now
+    _last_message_times.move_to_end(key)
+    
+    if waiting is not None:
+        # The waiting reply hasn't started generating, so this message joins it
+        waiting.cancel()
+        increment("messages_coalesced")
+    
+    generating = _generating_replies.get(key)
+    if CANCEL_ON_NEW_MESSAGE and generating is not None and not generating.done():
+        # The reply being generated answers an outdated conversation, stop it and free its connection
+        logger.info(f"Cancelling the reply to user {user_id} and {character_id}, a newer message arrived")
+        generating.cancel()
+        increment("replies_cancelled")
+    
+    delay = MESSAGE_DEBOUNCE_SECONDS if in_burst else min(MESSAGE_GRACE_SECONDS, MESSAGE_DEBOUNCE_SECONDS)
+    _waiting_replies[key] = context.application.create_task(
+        _debounced_reply(update, context, character_manager, user_id, character_id, character, delay)
+    )
+    # Keep the user cached until the reply is done, even if it is cancelled before it starts
+    character_manager.pin_user(user_id)
+    _waiting_replies[key].add_done_callback(lambda task: character_manager.unpin_user(user_id))
+
+def cancel_reply(user_id: int, character_id: str) -> bool:
+    """
+    Cancel the waiting and in-flight replies of a conversation, e.g. before it is reset,
+    so no answer is added to a history that was cleared. Returns True if a reply was cancelled.
+    """
+    key = (user_id, character_id)
+    cancelled = False
+    for replies in (_waiting_replies, _generating_replies):
+        task = replies.pop(key, None)
+        if task is not None and not task.done():
+            task.cancel()
+            cancelled = True
+    
+    if cancelled:
+        logger.info(f"Cancelled the reply to user {user_id} and {character_id}")
+        increment("replies_cancelled")
+    return cancelled
+
+async def _debounced_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, character_manager, user_id: int,
+                           character_id: str, character: Dict, delay: float) -> None:
+    """Wait out the debounce window, then reply to every message received so far"""
+    key = (user_id, character_id)
+    await asyncio.sleep(delay)
+    
+    # From here on newer messages start a new window instead of joining this reply
+    current = asyncio.current_task()
+    if _waiting_replies.get(key) is current:
+        del _waiting_replies[key]
+    
+    # Replies to one conversation are generated one at a time, in order
+    previous = _generating_replies.get(key)
+    _generating_replies[key] = current
+    try:
+        if previous is not None and not previous.done():
+            await asyncio.wait([previous])
+        await _reply(update, context, character_manager, user_id, character_id, character)
+    finally:
+        if _generating_replies.get(key) is current:
+            del _generating_replies[key]
+
+async def _reply(update: Update, context: ContextTypes.DEFAULT_TYPE, character_manager, user_id: int,
+                 selected_character_id: str, character: Dict) -> None:
+    """Generate the character's reply to the conversation so far and send it"""
+    # An earlier reply may already have answered every message, e.g. when replies weren't cancelled
     conversation_history = character_manager.get_conversation_history(user_id, selected_character_id)
+    if not conversation_history or conversation_history[-1]["role"] != "user":
+        return
+    answered_message = conversation_history[-1]
+    
+    # Keep one user from using up the shared Mistral quota; their messages stay in the history for the next reply
+    if not await get_rate_limiter().acquire(user_id):
+        await update.message.reply_text(
+            f"{character['name']} needs a moment to catch up. Please wait a little before sending more messages."
+        )
+        return
+    
+    # Get the summary of earlier messages that are no longer in the history
+    conversation_summary = character_manager.get_conversation_summary(user_id, selected_character_id)
+    
+    # Recall evicted messages relevant to the user's latest messages
+    memories = None
+    if character_manager.memory_store is not None:
+        latest_messages = []
+        for message in reversed(conversation_history):
+            if message["role"] != "user":
+                break
+            latest_messages.append(message["content"])
+        memories = await character_manager.memory_store.search(
+            user_id, selected_character_id, " ".join(reversed(latest_messages))
+        )
     
     # Get the character stats
     character_stats = character_manager.get_character_stats(user_id, selected_character_id)
@@ -132,16 +262,39 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             }
         }
     
-    # Update conversation count
-    character_stats["conversation_count"] += 1
+    # Update conversation count on a copy, so the stored stats only change if the reply is kept
+    character_stats = {**character_stats, "conversation_count": character_stats["conversation_count"] + 1}
     
     # Generate a response from the character using Mistral AI
     try:
-        response, mood_change = await generate_response(
-            character,
-            conversation_history,
-            character_stats
-        )
+        if STREAM_RESPONSES:
+            # Stream the reply into Telegram as it is generated
+            streaming_reply = StreamingReply(update.message)
+            stream = generate_response_stream(character, conversation_history, character_stats,
+                                              conversation_summary, selected_character_id, memories)
+            # Close the stream right away if this reply is cancelled, so its connection is released
+            async with contextlib.aclosing(stream):
+                async for delta in stream:
+                    await streaming_reply.add(delta)
+            response = await streaming_reply.finish()
+            mood_change = calculate_mood_change(response)
+        else:
+            response, mood_change = await generate_response(
+                character,
+                conversation_history,
+                character_stats,
+                conversation_summary,
+                selected_character_id,
+                memories
+            )
+        
+        # Messages that arrived meanwhile are answered by the reply scheduled for them; adding this one after
+        # them would put it out of order, so it is dropped (a streamed reply has been shown already)
+        current_history = character_manager.get_conversation_history(user_id, selected_character_id)
+        if not current_history or current_history[-1] is not answered_message:
+            logger.info(f"Dropping the reply to user {user_id} and {selected_character_id}, newer messages arrived")
+            increment("replies_stale")
+            return
         
         # Update the character's mood based on the response
         new_mood = max(1, min(10, character_stats["mood"] + mood_change))
@@ -153,73 +306,166 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         # Add the response to the conversation history
         character_manager.add_to_conversation_history(user_id, selected_character_id, "assistant", response)
         
-        # Format emotional expressions in the response
-        formatted_response = format_emotional_expressions(response)
-        
-        # Check if message is too long (Telegram limit is 4096 characters)
-        if len(formatted_response) > 4000:  # Use 4000 as a safe limit
-            # Split message into chunks of about 4000 characters
-            # Try to split at sentence boundaries when possible
-            chunks = []
-            current_chunk = ""
-            
-            # First try to split at paragraph boundaries
-            paragraphs = formatted_response.split('\n\n')
-            for paragraph in paragraphs:
-                if len(current_chunk) + len(paragraph) + 2 <= 4000:
-                    if current_chunk:
-                        current_chunk += '\n\n'
-                    current_chunk += paragraph
-                else:
-                    if current_chunk:
-                        chunks.append(current_chunk)
-                    current_chunk = paragraph
-            
-            if current_chunk:
-                chunks.append(current_chunk)
-            
-            # Send each chunk
-            for i, chunk in enumerate(chunks):
-                try:
-                    if formatted_response != response:
-                        # Add a continuation indicator for multi-part messages
-                        if i < len(chunks) - 1:
-                            chunk += "\n\n\\.\\.\\."  # Escaped dots for MarkdownV2
-                        if i > 0:
-                            chunk = "\\.\\.\\.\n\n" + chunk  # Escaped dots for MarkdownV2
-                        
-                        await update.message.reply_text(chunk, parse_mode="MarkdownV2")
-                    else:
-                        # Add a continuation indicator for multi-part messages
-                        if i < len(chunks) - 1:
-                            chunk += "\n\n..."
-                        if i > 0:
-                            chunk = "...\n\n" + chunk
-                            
-                        await update.message.reply_text(chunk)
-                except Exception as chunk_error:
-                    logger.error(f"Error sending message chunk: {str(chunk_error)}")
-                    # Try without markdown as fallback
-                    try:
-                        await update.message.reply_text(chunk.replace('`', ''))
-                    except:
-                        pass
-        else:
-            # Send the response with MarkdownV2 parsing mode if formatting was applied
-            if formatted_response != response:
-                try:
-                    # Use Markdown for the formatted response
-                    await update.message.reply_text(formatted_response, parse_mode="MarkdownV2")
-                except Exception as markdown_error:
-                    logger.error(f"Error sending formatted message: {str(markdown_error)}")
-                    # Fallback to plain text if Markdown fails
-                    await update.message.reply_text(response)
-            else:
-                # Send as plain text if no formatting was applied
-                await update.message.reply_text(response)
+        if not STREAM_RESPONSES:
+            await _send_response(update, response)
         
+        # Fold evicted messages into the summary in the background, outside the reply path
+        if needs_summary(character_manager, user_id, selected_character_id):
+            context.application.create_task(
+                update_conversation_summary(character_manager, user_id, selected_character_id, character)
+            )
+        
+    except MistralUnavailableError as e:
+        logger.warning(f"Not generating a response: {str(e)}")
+        await update.message.reply_text(
+            f"{character['name']} can't respond right now because the service is overloaded. "
+            "Please try again in a minute."
+        )
+    
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         await update.message.reply_text(
             f"Sorry, I couldn't generate a response from {character['name']} right now. Please try again later."
         )
+
+async def _send_response(update: Update, response: str) -> None:
+    """Send a complete response, formatted and split into chunks if it is too long"""
+    # Format emotional expressions in the response
+    formatted_response = format_emotional_expressions(response)
+    
+    # Check if message is too long (Telegram limit is 4096 characters)
+    if len(formatted_response) > 4000:  # Use 4000 as a safe limit
+        # Split message into chunks of about 4000 characters
+        # Try to split at sentence boundaries when possible
+        chunks = []
+        current_chunk = ""
+        
+        # First try to split at paragraph boundaries
+        paragraphs = formatted_response.split('\n\n')
+        for paragraph in paragraphs:
+            if len(current_chunk) + len(paragraph) + 2 <= 4000:
+                if current_chunk:
+                    current_chunk += '\n\n'
+                current_chunk += paragraph
+            else:
+                if current_chunk:
+                    chunks.append(current_chunk)
+                current_chunk = paragraph
+        
+        if current_chunk:
+            chunks.append(current_chunk)
+        
+        # Send each chunk
+        for i, chunk in enumerate(chunks):
+            try:
+                if formatted_response != response:
+                    # Add a continuation indicator for multi-part messages
+                    if i < len(chunks) - 1:
+                        chunk += "\n\n\\.\\.\\."  # Escaped dots for MarkdownV2
+                    if i > 0:
+                        chunk = "\\.\\.\\.\n\n" + chunk  # Escaped dots for MarkdownV2
+                    
+                    await update.message.reply_text(chunk, parse_mode="MarkdownV2")
+                else:
+                    # Add a continuation indicator for multi-part messages
+                    if i < len(chunks) - 1:
+                        chunk += "\n\n..."
+                    if i > 0:
+                        chunk = "...\n\n" + chunk
+                        
+                    await update.message.reply_text(chunk)
+            except Exception as chunk_error:
+                logger.error(f"Error sending message chunk: {str(chunk_error)}")
+                # Try without markdown as fallback
+                try:
+                    await update.message.reply_text(chunk.replace('`', ''))
+                except:
+                    pass
+    else:
+        # Send the response with MarkdownV2 parsing mode if formatting was applied
+        if formatted_response != response:
+            try:
+                # Use Markdown for the formatted response
+                await update.message.reply_text(formatted_response, parse_mode="MarkdownV2")
+            except Exception as markdown_error:
+                logger.error(f"Error sending formatted message: {str(markdown_error)}")
+                # Fallback to plain text if Markdown fails
+                await update.message.reply_text(response)
+        else:
+            # Send as plain text if no formatting was applied
+            await update.message.reply_text(response)
+
+class StreamingReply:
+    """
+    Sends a reply while it is being generated: the first text is sent as a new message,
+    which is then edited at most once every STREAM_EDIT_INTERVAL seconds to respect
+    Telegram's rate limits. Text beyond one message's length continues in a new message.
+    """
+    def __init__(self, message: Message, edit_interval: float = STREAM_EDIT_INTERVAL):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.chunks: List[str] = []
+        self._current_text = ""
+        self._sent_message: Optional[Message] = None
+        self._sent_text = ""
+        self._next_edit_at = 0.0
+    
+    async def add(self, delta: str) -> None:
+        """Add newly generated text, sending or editing the message if it is time to"""
+        self.chunks.append(delta)
+        self._current_text += delta
+        
+        # Move on to a new message once the current one is full
+        while len(self._current_text) > 4000:
+            split_at = self._current_text.rfind('\n\n', 0, 4000)
+            if split_at <= 0:
+                split_at = 4000
+            full_text, self._current_text = self._current_text[:split_at], self._current_text[split_at:].lstrip()
+            await self._show(full_text, force=True)
+            self._sent_message = None
+            self._sent_text = ""
+        
+        await self._show(self._current_text)
+    
+    async def finish(self) -> str:
+        """Show the final, formatted text and return the whole response"""
+        response = "".join(self.chunks)
+        if not self._current_text.strip():
+            return response
+        
+        formatted_text = format_emotional_expressions(self._current_text)
+        if formatted_text != self._current_text and self._sent_message is not None:
+            try:
+                await self._sent_message.edit_text(formatted_text, parse_mode="MarkdownV2")
+                return response
+            except TelegramError as markdown_error:
+                logger.error(f"Error sending formatted message: {str(markdown_error)}")
+        
+        await self._show(self._current_text, force=True)
+        return response
+    
+    async def _show(self, text: str, force: bool = False) -> None:
+        """Send or edit the current message with plain text, throttling edits"""
+        if not text.strip() or text == self._sent_text:
+            return
+        
+        now = time.monotonic()
+        if self._sent_message is not None and not force and now < self._next_edit_at:
+            return
+        
+        try:
+            if self._sent_message is None:
+                self._sent_message = await self.message.reply_text(text)
+            else:
+                await self._sent_message.edit_text(text)
+            self._sent_text = text
+        except RetryAfter as e:
+            # Telegram asked us to slow down; skip edits until it allows them again
+            logger.warning(f"Rate limited while streaming, retrying after {e.retry_after}s")
+            self._next_edit_at = now + float(e.retry_after)
+            if force:
+                await asyncio.sleep(float(e.retry_after))
+                await self._show(text, force=True)
+            return
+        
+        self._next_edit_at = now + self.edit_interval
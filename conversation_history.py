@@ -0,0 +1,78 @@
+"""
+Compact in-memory conversation history. Messages are __slots__ records instead of dicts,
+with the role interned so every message shares the same few role strings, and each
+conversation is a fixed-capacity ring buffer that drops its oldest message without copying.
+Both still read like the dicts and lists they replace and are written to JSON as such.
+"""
+
+import sys
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional
+from token_budget import history_window_start
+
+class Message:
+    """One history message; supports message["role"] style access like the dicts it replaces"""
+    __slots__ = ("role", "content", "tokens")
+    
+    def __init__(self, role: str, content: str, tokens: Optional[int] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.tokens = tokens
+    
+    @classmethod
+    def from_dict(cls, message: Dict[str, Any]) -> "Message":
+        return cls(message["role"], message["content"], message.get("tokens"))
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """The message in the stored JSON format"""
+        if self.tokens is None:
+            return {"role": self.role, "content": self.content}
+        return {"role": self.role, "content": self.content, "tokens": self.tokens}
+    
+    def __getitem__(self, key: str) -> Any:
+        if key not in Message.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+    
+    def __setitem__(self, key: str, value: Any) -> None:
+        if key not in Message.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        value = getattr(self, key, None) if key in Message.__slots__ else None
+        return default if value is None else value
+    
+    def __deepcopy__(self, memo: Dict) -> "Message":
+        # Messages never change once their token estimate is set, so copies can share them
+        return self
+    
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content!r}, {self.tokens!r})"
+
+class ConversationHistory(deque):
+    """The messages of one conversation, oldest first, keeping at most maxlen of them"""
+    def __init__(self, messages: Iterable = (), maxlen: Optional[int] = None):
+        super().__init__((m if isinstance(m, Message) else Message.from_dict(m) for m in messages), maxlen)
+    
+    def push(self, message: Message) -> Optional[Message]:
+        """Append a message and return the oldest one if it was dropped to make room"""
+        evicted = self[0] if self and len(self) == self.maxlen else None
+        self.append(message)
+        return evicted
+    
+    def trim_to_tokens(self, max_tokens: int) -> List[Message]:
+        """Drop the oldest messages until the rest fit in max_tokens, keeping the newest; return the dropped ones"""
+        return [self.popleft() for _ in range(history_window_start(self, max_tokens))]
+    
+    def __deepcopy__(self, memo: Dict) -> "ConversationHistory":
+        return ConversationHistory(self, self.maxlen)
+
+def to_json(value: Any) -> Any:
+    """json.dumps default hook that writes messages and histories as plain dicts and lists"""
+    if isinstance(value, ConversationHistory):
+        # Converted here in one go rather than calling back once per message
+        return [message.to_dict() for message in value]
+    if isinstance(value, Message):
+        return value.to_dict()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -6,56 +6,185 @@ you might want to use a proper database.
 
 import os
 import json
+import glob
+import itertools
 import logging
-from typing import Dict, Any, Optional
+import asyncio
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Any, Iterable, Iterator, List, Optional, Tuple, Union
+from conversation_history import to_json
+from metrics import increment, set_gauge
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
 
 logger = logging.getLogger(__name__)
 
+DATA_DIR = "data"
+
+# Format of saved data files: "json" (compact), "orjson" (same JSON, faster) or "msgpack" (binary);
+# files in any of them are read regardless, so the setting can change between runs
+STORAGE_SERIALIZER = os.getenv("STORAGE_SERIALIZER", "json")
+
+# Users whose data is kept in memory; the least recently used are evicted once flushed (0 keeps every user)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+class JSONSerializer:
+    """Compact JSON with the standard library"""
+    name = "json"
+    
+    def dumps(self, data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=to_json).encode("utf-8")
+    
+    def loads(self, raw: bytes) -> Any:
+        return json.loads(raw)
+
+class OrjsonSerializer:
+    """Compact JSON with orjson, several times faster than the standard library"""
+    name = "orjson"
+    
+    def dumps(self, data: Any) -> bytes:
+        return orjson.dumps(data, default=to_json)
+    
+    def loads(self, raw: bytes) -> Any:
+        return orjson.loads(raw)
+
+class MsgpackSerializer:
+    """MessagePack, a binary format that is smaller than JSON and fast to read"""
+    name = "msgpack"
+    
+    def dumps(self, data: Any) -> bytes:
+        return msgpack.packb(data, default=to_json, use_bin_type=True)
+    
+    def loads(self, raw: bytes) -> Any:
+        return msgpack.unpackb(raw, raw=False, strict_map_key=False)
+
+# JSON is read and journaled with orjson whenever it is installed, whichever format is saved
+_json = OrjsonSerializer() if orjson is not None else JSONSerializer()
+
+def create_serializer(name: Optional[str] = None):
+    """Create the serializer for saved files, falling back to JSON if its package isn't installed"""
+    name = name or STORAGE_SERIALIZER
+    if name == "json":
+        return JSONSerializer()
+    if name == "orjson":
+        if orjson is not None:
+            return OrjsonSerializer()
+        logger.warning("orjson is not installed, saving data as JSON with the standard library")
+        return JSONSerializer()
+    if name == "msgpack":
+        if msgpack is not None:
+            return MsgpackSerializer()
+        logger.warning("msgpack is not installed, saving data as JSON")
+        return _json
+    
+    raise ValueError(f"Unknown STORAGE_SERIALIZER: {name}")
+
+_serializer = None
+
+def get_serializer():
+    """Get the serializer used to save data files"""
+    global _serializer
+    if _serializer is None:
+        _serializer = create_serializer()
+    return _serializer
+
+def set_serializer(serializer) -> None:
+    """Replace the serializer used to save data files, e.g. to compare them in benchmarks"""
+    global _serializer
+    _serializer = serializer
+
+def decode_data(raw: bytes) -> Any:
+    """Decode the contents of a data file, detecting whether it was saved as JSON or MessagePack"""
+    # A JSON file starts with an object or array; MessagePack maps and arrays start with other bytes
+    if raw.lstrip()[:1] in (b"{", b"["):
+        return _json.loads(raw)
+    if msgpack is None:
+        raise ValueError("the file is not JSON and msgpack is not installed to read it as MessagePack")
+    return MsgpackSerializer().loads(raw)
+
 def ensure_data_directory_exists() -> None:
     """Ensure that the data directory exists"""
     if not os.path.exists("data"):
         os.makedirs("data")
 
 def load_json_file(file_path: str, default_value: Any = None) -> Any:
-    """Load data from a JSON file"""
+    """Load data from a JSON or MessagePack file"""
     if default_value is None:
         default_value = {}
     
     try:
         if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            with open(file_path, 'rb') as f:
+                return decode_data(f.read())
         else:
             return default_value
-    except json.JSONDecodeError as e:
-        logger.error(f"Error decoding JSON file {file_path}: {e}")
+    except ValueError as e:
+        logger.error(f"Error decoding data file {file_path}: {e}")
         return default_value
     except Exception as e:
         logger.error(f"Error loading file {file_path}: {e}")
         return default_value
 
+def atomic_write_file(file_path: str, text: Union[str, bytes]) -> None:
+    """
+    Write text or bytes to a file atomically: the data goes to a temporary file in the same
+    directory, is fsynced, and then replaces the target with a rename.
+    A crash mid-write leaves either the old or the new file, never a truncated one.
+    """
+    directory = os.path.dirname(file_path) or "."
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=".json")
+    try:
+        if isinstance(text, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding='utf-8')
+        with f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, file_path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
 def save_json_file(file_path: str, data: Any) -> bool:
-    """Save data to a JSON file"""
+    """Save data to a file in the format of the configured serializer"""
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        atomic_write_file(file_path, get_serializer().dumps(data))
         return True
     except Exception as e:
         logger.error(f"Error saving file {file_path}: {e}")
         return False
 
+def get_user_data_path(user_id: int, data_dir: str = DATA_DIR) -> str:
+    """Get the path of the per-user data file"""
+    return os.path.join(data_dir, f"user_{user_id}.json")
+
 def get_user_data(user_id: int) -> Dict[str, Any]:
     """Get data for a specific user"""
     ensure_data_directory_exists()
     
-    user_data_file = f"data/user_{user_id}.json"
+    user_data_file = get_user_data_path(user_id)
     return load_json_file(user_data_file, {"selected_character": None, "custom_characters": []})
 
 def save_user_data(user_id: int, data: Dict[str, Any]) -> bool:
     """Save data for a specific user"""
     ensure_data_directory_exists()
     
-    user_data_file = f"data/user_{user_id}.json"
+    user_data_file = get_user_data_path(user_id)
     return save_json_file(user_data_file, data)
 
 def get_custom_characters() -> Dict[str, Dict[str, Any]]:
@@ -71,3 +200,361 @@ def save_custom_characters(custom_characters: Dict[str, Dict[str, Any]]) -> bool
     
     custom_characters_file = "data/custom_characters.json"
     return save_json_file(custom_characters_file, custom_characters)
+
+class MonolithicUserStore:
+    """
+    Stores the data of every user in a single JSON file.
+    Saving any user rewrites the whole file.
+    """
+    rewrites_all_users = True
+    
+    def __init__(self, file_path: str):
+        self.file_path = file_path
+    
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """Load the data of all users"""
+        return load_json_file(self.file_path)
+    
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load the data of a single user, or None if the user is unknown"""
+        return self.load_all().get(str(user_id))
+    
+    def save(self, user_data: Dict[str, Dict[str, Any]], user_ids: Iterable[str],
+             mutations: Optional[Dict[str, List]] = None) -> bool:
+        """Save the given users; the whole file is rewritten regardless of which users changed"""
+        return save_json_file(self.file_path, user_data)
+
+class ShardedUserStore:
+    """
+    Stores the data of each user in its own data/user_{id}.json file.
+    Saving a user only rewrites that user's file.
+    """
+    rewrites_all_users = False
+    
+    def __init__(self, data_dir: str = DATA_DIR):
+        self.data_dir = data_dir
+    
+    def _user_ids_on_disk(self) -> Iterable[str]:
+        """List the ids of all users that have a data file"""
+        for file_name in os.listdir(self.data_dir):
+            if file_name.startswith("user_") and file_name.endswith(".json"):
+                yield file_name[len("user_"):-len(".json")]
+    
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """Load the data of all users"""
+        user_data = {}
+        for user_id in self._user_ids_on_disk():
+            record = self.load_user(user_id)
+            if record is not None:
+                user_data[user_id] = record
+        return user_data
+    
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load the data of a single user, or None if the user is unknown"""
+        return load_json_file(get_user_data_path(user_id, self.data_dir), None) or None
+    
+    def save(self, user_data: Dict[str, Dict[str, Any]], user_ids: Iterable[str],
+             mutations: Optional[Dict[str, List]] = None) -> bool:
+        """Save only the given users, each to their own file"""
+        success = True
+        for user_id in user_ids:
+            if str(user_id) in user_data:
+                success = save_json_file(get_user_data_path(user_id, self.data_dir), user_data[str(user_id)]) and success
+        return success
+
+def migrate_user_data_to_shards(source_file: str, data_dir: str = DATA_DIR) -> int:
+    """
+    One-shot migration of a monolithic user_data.json into per-user files.
+    The source file is renamed to <source_file>.migrating while it is migrated and to
+    <source_file>.migrated once every user is written; a migration interrupted in between
+    is resumed from the .migrating file, since writing a user's file again is harmless.
+    Returns the number of migrated users; raises IOError, leaving the source in place,
+    if it can't be read or written.
+    """
+    # Claim the file first so two processes starting together don't both migrate it
+    claimed_file = f"{source_file}.migrating"
+    try:
+        os.rename(source_file, claimed_file)
+    except FileNotFoundError:
+        if not os.path.exists(claimed_file):
+            return 0
+        logger.warning(f"Resuming the interrupted migration of {source_file} to per-user files")
+    
+    # Read it strictly: load_json_file would turn a corrupt file into no users and the migration would lose them
+    try:
+        with open(claimed_file, 'rb') as f:
+            user_data = decode_data(f.read())
+        if not isinstance(user_data, dict):
+            raise ValueError(f"expected an object of users, got {type(user_data).__name__}")
+    except Exception as e:
+        os.rename(claimed_file, source_file)
+        raise IOError(f"Failed to read {source_file}, not migrating it to per-user files: {e}") from e
+    
+    store = ShardedUserStore(data_dir)
+    if not store.save(user_data, user_data.keys()):
+        # Put the source back so the migration is retried on the next start
+        os.rename(claimed_file, source_file)
+        raise IOError(f"Failed to migrate {source_file} to per-user files")
+    
+    os.rename(claimed_file, f"{source_file}.migrated")
+    logger.info(f"Migrated {len(user_data)} users from {source_file} to per-user files")
+    return len(user_data)
+
+class MutationJournal:
+    """
+    Append-only journal of user data changes that have not been flushed to the user store yet.
+    
+    Each line holds one change of a user. A user's first change in a segment also holds their
+    full record after it; later changes in the segment hold only the change, which replay
+    applies on top of that record. Stores that record changes as rows get the changes too.
+    The journal is split into numbered segments: a flush rotates to a new segment and, once
+    the flushed users are safely stored, deletes the older segments.
+    
+    Entries are serialized by the caller but written by a single background thread, in order,
+    so neither the write nor an optional fsync blocks the event loop.
+    """
+    def __init__(self, data_dir: str = DATA_DIR, fsync: bool = False):
+        self.prefix = os.path.join(data_dir, "user_data.journal.")
+        self.fsync = fsync
+        self._segment = max(self._segments_on_disk(), default=0) + 1
+        self._file = None
+        self._file_segment = None
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="journal")
+    
+    def _segments_on_disk(self) -> Iterable[int]:
+        """List the numbers of all journal segments on disk"""
+        for path in glob.glob(f"{self.prefix}*"):
+            suffix = path[len(self.prefix):]
+            if suffix.isdigit():
+                yield int(suffix)
+    
+    def _write(self, segment: int, line: bytes) -> None:
+        """Write a line to a segment (runs on the writer thread)"""
+        try:
+            if self._file_segment != segment:
+                self._close_file()
+                self._file = open(f"{self.prefix}{segment}", 'ab')
+                self._file_segment = segment
+            
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+        except Exception as e:
+            logger.error(f"Error writing to journal segment {segment}: {e}")
+    
+    def _close_file(self) -> None:
+        """Close the open segment file (runs on the writer thread)"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self._file_segment = None
+    
+    def _remove_through(self, segment: int) -> None:
+        """Delete segments up to and including the given one (runs on the writer thread)"""
+        if self._file_segment is not None and self._file_segment <= segment:
+            self._close_file()
+        
+        for number in self._segments_on_disk():
+            if number <= segment:
+                try:
+                    os.remove(f"{self.prefix}{number}")
+                except OSError as e:
+                    logger.error(f"Error removing journal segment {number}: {e}")
+    
+    def append(self, user_id: str, record: Optional[Dict[str, Any]], mutation: Optional[List[Any]] = None) -> None:
+        """Append a change of a user to the journal, with their current record unless it is None"""
+        entry = {"user_id": user_id, "mutation": mutation}
+        if record is not None:
+            entry["record"] = record
+        self._writer.submit(self._write, self._segment, _json.dumps(entry) + b"\n")
+    
+    def rotate(self) -> int:
+        """Start a new segment and return the number of the last one that was written to"""
+        segment = self._segment
+        self._segment += 1
+        return segment
+    
+    def discard_through(self, segment: int) -> None:
+        """Delete every segment up to and including the given one once its changes are stored"""
+        self._writer.submit(self._remove_through, segment)
+    
+    def replay(self) -> Iterator[Tuple[str, Optional[Dict[str, Any]], Optional[List[Any]]]]:
+        """Yield (user_id, record or None, mutation) for every journaled change, oldest first"""
+        for number in sorted(self._segments_on_disk()):
+            if number >= self._segment:
+                continue
+            
+            with open(f"{self.prefix}{number}", 'rb') as f:
+                for line in f:
+                    try:
+                        entry = _json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-append
+                        logger.warning(f"Skipping corrupt entry in journal segment {number}")
+                        continue
+                    yield entry["user_id"], entry.get("record"), entry.get("mutation")
+    
+    def close(self) -> None:
+        """Finish pending writes and close the active segment"""
+        self._writer.submit(self._close_file)
+        self._writer.shutdown(wait=True)
+
+class AsyncUserStore:
+    """
+    Async interface to a user store. The store's blocking file or database calls run on a
+    dedicated thread pool, so storage latency never stalls the event loop serving other chats.
+    """
+    def __init__(self, store, max_workers: Optional[int] = None):
+        self.store = store
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or int(os.getenv("STORAGE_THREADS", "4")),
+            thread_name_prefix="storage"
+        )
+    
+    async def _run(self, function, *args):
+        """Run a blocking store call on the storage thread pool"""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+    
+    async def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """Load the data of all users"""
+        return await self._run(self.store.load_all)
+    
+    async def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load the data of a single user, or None if the user is unknown"""
+        return await self._run(self.store.load_user, user_id)
+    
+    async def save(self, user_data: Dict[str, Dict[str, Any]], user_ids: Iterable[str],
+                   mutations: Optional[Dict[str, List]] = None) -> bool:
+        """Save the given users"""
+        return await self._run(self.store.save, user_data, user_ids, mutations)
+    
+    async def save_json_file(self, file_path: str, data: Any) -> bool:
+        """Save data to a JSON file"""
+        return await self._run(save_json_file, file_path, data)
+    
+    def close(self) -> None:
+        """Wait for running calls and stop the thread pool"""
+        self._executor.shutdown(wait=True)
+
+class UserCache:
+    """
+    The user records CharacterManager works on, read from the user store the first time each
+    user is looked up and kept in an LRU of at most max_users records (0 keeps every user).
+    Users that can't be evicted yet, e.g. with changes that aren't flushed, are skipped until
+    evict() is called again. Stores that rewrite every user on save are loaded whole instead.
+    """
+    def __init__(self, store, max_users: int = USER_CACHE_SIZE,
+                 prepare: Optional[Callable[[Dict[str, Any]], Any]] = None,
+                 can_evict: Optional[Callable[[str], bool]] = None):
+        self.store = store
+        self.prepare = prepare
+        self.can_evict = can_evict
+        # Users that are known not to exist are cached as None
+        self._records: "OrderedDict[str, Optional[Dict[str, Any]]]" = OrderedDict()
+        
+        # The whole file is rewritten from the cache, so every user has to stay in it
+        self._complete = getattr(store, "rewrites_all_users", False)
+        self.max_users = 0 if self._complete else max_users
+        if self._complete:
+            for user_id, record in store.load_all().items():
+                self._add(user_id, record)
+    
+    def _add(self, user_id: str, record: Optional[Dict[str, Any]]) -> None:
+        if record is not None and self.prepare is not None:
+            self.prepare(record)
+        self._records[user_id] = record
+    
+    def _lookup(self, user_id: str) -> Optional[Dict[str, Any]]:
+        if user_id in self._records:
+            self._records.move_to_end(user_id)
+            increment("user_cache_hits")
+            return self._records[user_id]
+        if self._complete:
+            return None
+        
+        increment("user_cache_misses")
+        self._add(user_id, self.store.load_user(user_id))
+        self.evict()
+        return self._records[user_id]
+    
+    def peek(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Get a cached record without reading the store or counting it as a use"""
+        return self._records.get(user_id)
+    
+    def is_resident(self, user_id: str) -> bool:
+        """Whether a user's record (or its absence) is cached, without reading the store"""
+        return self._complete or user_id in self._records
+    
+    def add_loaded(self, user_id: str, record: Optional[Dict[str, Any]]) -> None:
+        """Cache a record read ahead of time, unless the user was loaded in the meantime"""
+        if user_id not in self._records:
+            increment("user_cache_misses")
+            self._add(user_id, record)
+            self.evict()
+    
+    def evict(self) -> None:
+        """Drop the least recently used users beyond max_users, skipping those that can't be evicted"""
+        if self.max_users <= 0 or len(self._records) <= self.max_users:
+            set_gauge("user_cache_users", len(self._records))
+            return
+        
+        # The most recently used user is never evicted, its record may be about to change
+        excess = len(self._records) - self.max_users
+        evicted = []
+        for user_id in itertools.islice(self._records, len(self._records) - 1):
+            if len(evicted) == excess:
+                break
+            if self._records[user_id] is None or self.can_evict is None or self.can_evict(user_id):
+                evicted.append(user_id)
+        
+        for user_id in evicted:
+            del self._records[user_id]
+        increment("user_cache_evictions", len(evicted))
+        set_gauge("user_cache_users", len(self._records))
+    
+    def __contains__(self, user_id: str) -> bool:
+        return self._lookup(user_id) is not None
+    
+    def __getitem__(self, user_id: str) -> Dict[str, Any]:
+        record = self._lookup(user_id)
+        if record is None:
+            raise KeyError(user_id)
+        return record
+    
+    def __setitem__(self, user_id: str, record: Dict[str, Any]) -> None:
+        self._records[user_id] = record
+        self._records.move_to_end(user_id)
+        self.evict()
+    
+    def get(self, user_id: str, default: Any = None) -> Any:
+        record = self._lookup(user_id)
+        return default if record is None else record
+    
+    def items(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """The cached users and their records"""
+        return ((user_id, record) for user_id, record in self._records.items() if record is not None)
+    
+    def __len__(self) -> int:
+        return sum(1 for record in self._records.values() if record is not None)
+
+def create_user_store(data_dir: str = DATA_DIR, backend: Optional[str] = None):
+    """
+    Create the user data store selected by the USER_DATA_BACKEND environment variable.
+    "sharded" (default) keeps one file per user, "json" keeps the single user_data.json file
+    and "database" uses the SQLAlchemy models at DATABASE_URL.
+    """
+    backend = backend or os.getenv("USER_DATA_BACKEND", "sharded")
+    monolithic_file = os.path.join(data_dir, "user_data.json")
+    
+    if backend == "json":
+        return MonolithicUserStore(monolithic_file)
+    if backend == "sharded":
+        migrate_user_data_to_shards(monolithic_file, data_dir)
+        return ShardedUserStore(data_dir)
+    if backend == "database":
+        # Imported here because it pulls in the Flask app and its database
+        from db_storage import SQLAlchemyUserStore
+        return SQLAlchemyUserStore()
+    
+    raise ValueError(f"Unknown USER_DATA_BACKEND: {backend}")
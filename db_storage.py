@@ -0,0 +1,191 @@
+"""
+User data store backed by the SQLAlchemy models in models.py.
+Each new message is inserted as one ConversationMessage row instead of rewriting a file,
+and only the most recent messages of a conversation are loaded.
+"""
+
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from app import app, db
+from models import CharacterStat, Conversation, ConversationMessage, User
+from token_budget import HISTORY_TOKEN_BUDGET, history_window_start
+
+logger = logging.getLogger(__name__)
+
+# Length of the appends and resets that carry an id as their last item; those journaled before ids were added don't
+_MUTATION_ID_LENGTHS = {"append": 6, "reset": 3}
+
+def _mutation_id(mutation: List[Any]) -> Optional[str]:
+    """The id of an append or reset, or None for other changes and those without an id"""
+    length = _MUTATION_ID_LENGTHS.get(mutation[0])
+    return mutation[length - 1] if length is not None and len(mutation) >= length else None
+
+class SQLAlchemyUserStore:
+    """
+    Stores user data in the database configured by DATABASE_URL (SQLite by default).
+    Conversation messages are recorded as rows from the mutations passed to save(),
+    so the record's history itself is never rewritten.
+    """
+    rewrites_all_users = False
+    records_messages = True
+    
+    def __init__(self, history_limit: Optional[int] = None):
+        # Imported here to avoid a circular import with character_manager
+        from character_manager import HISTORY_MAX_MESSAGES
+        self.history_limit = history_limit or HISTORY_MAX_MESSAGES
+    
+    def get_recent_messages(self, conversation_id: int, limit: int,
+                            before_id: Optional[int] = None) -> List[ConversationMessage]:
+        """
+        Get up to `limit` messages of a conversation, oldest first, ending just before
+        message `before_id` if given. Pass the id of the first message to page further back.
+        """
+        query = ConversationMessage.query.filter_by(conversation_id=conversation_id)
+        if before_id is not None:
+            query = query.filter(ConversationMessage.id < before_id)
+        messages = query.order_by(ConversationMessage.timestamp.desc(), ConversationMessage.id.desc()) \
+            .limit(limit).all()
+        messages.reverse()
+        return messages
+    
+    def _latest_conversations(self, user: User) -> Dict[str, Conversation]:
+        """Get the current conversation of a user with each character"""
+        conversations = {}
+        for conversation in Conversation.query.filter_by(user_id=user.id).order_by(Conversation.id):
+            conversations[conversation.character_id] = conversation
+        return conversations
+    
+    def _user_record(self, user: User) -> Dict[str, Any]:
+        """Build the CharacterManager record of a user from the database rows"""
+        record = {
+            "selected_character": user.selected_character,
+            "custom_characters": json.loads(user.custom_characters_json or "[]"),
+            "character_stats": {},
+            "conversation_history": {},
+            "conversation_summaries": {}
+        }
+        
+        for stat in CharacterStat.query.filter_by(user_id=user.id):
+            record["character_stats"][stat.character_id] = {
+                "mood": stat.mood,
+                "conversation_count": stat.conversation_count,
+                "personality_stats": json.loads(stat.personality_json or "{}")
+            }
+        
+        for character_id, conversation in self._latest_conversations(user).items():
+            # Only what still fits in the history token budget; older messages were summarised as they left it
+            history = [
+                {"role": message.role, "content": message.content, "tokens": message.tokens}
+                for message in self.get_recent_messages(conversation.id, self.history_limit)
+            ]
+            record["conversation_history"][character_id] = history[history_window_start(history, HISTORY_TOKEN_BUDGET):]
+            if conversation.summary_json:
+                record["conversation_summaries"][character_id] = json.loads(conversation.summary_json)
+        
+        return record
+    
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """Load the data of all users"""
+        with app.app_context():
+            return {str(user.telegram_id): self._user_record(user) for user in User.query.all()}
+    
+    def load_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Load the data of a single user, or None if the user is unknown"""
+        with app.app_context():
+            user = User.query.filter_by(telegram_id=int(user_id)).first()
+            return self._user_record(user) if user else None
+    
+    def _save_user(self, user_id: str, record: Dict[str, Any], mutations: List[List[Any]]) -> None:
+        """Write one user's record and mutations to the current session"""
+        now = datetime.utcnow()
+        user = User.query.filter_by(telegram_id=int(user_id)).first()
+        if user is None:
+            user = User(telegram_id=int(user_id))
+            db.session.add(user)
+            db.session.flush()
+        
+        user.selected_character = record.get("selected_character")
+        user.custom_characters_json = json.dumps(record.get("custom_characters", []))
+        user.last_active = now
+        
+        stats = {stat.character_id: stat for stat in CharacterStat.query.filter_by(user_id=user.id)}
+        for character_id, character_stats in record.get("character_stats", {}).items():
+            stat = stats.get(character_id)
+            if stat is None:
+                stat = CharacterStat(user_id=user.id, character_id=character_id)
+                db.session.add(stat)
+            stat.mood = character_stats["mood"]
+            stat.conversation_count = character_stats["conversation_count"]
+            stat.personality_json = json.dumps(character_stats.get("personality_stats", {}))
+            stat.last_interaction = now
+        
+        conversations = self._latest_conversations(user)
+        
+        def current_conversation(character_id: str) -> Conversation:
+            if character_id not in conversations:
+                conversation = Conversation(user_id=user.id, character_id=character_id, total_messages=0)
+                db.session.add(conversation)
+                db.session.flush()
+                conversations[character_id] = conversation
+            return conversations[character_id]
+        
+        # Changes replayed from the journal may have been stored already, by a flush that committed
+        # just before the bot stopped and left its journal segment behind
+        stored_ids = self._stored_mutation_ids(mutations)
+        
+        for mutation in mutations:
+            mutation_id = _mutation_id(mutation)
+            if mutation_id is not None and mutation_id in stored_ids:
+                continue
+            
+            if mutation[0] == "append":
+                _, character_id, role, content, tokens = mutation[:5]
+                conversation = current_conversation(character_id)
+                db.session.add(ConversationMessage(
+                    conversation_id=conversation.id, role=role, content=content, tokens=tokens, timestamp=now,
+                    mutation_id=mutation_id
+                ))
+                conversation.total_messages = (conversation.total_messages or 0) + 1
+                conversation.last_active = now
+            elif mutation[0] == "reset":
+                # A reset starts a new conversation; the old one's messages stay as an archive
+                _, character_id = mutation[:2]
+                conversations.pop(character_id, None)
+                current_conversation(character_id).mutation_id = mutation_id
+        
+        for character_id, summary in record.get("conversation_summaries", {}).items():
+            current_conversation(character_id).summary_json = json.dumps(summary)
+    
+    def _stored_mutation_ids(self, mutations: List[List[Any]]) -> Set[str]:
+        """Get the ids of the given appends and resets that are already stored"""
+        append_ids = [_mutation_id(mutation) for mutation in mutations
+                      if mutation[0] == "append" and _mutation_id(mutation) is not None]
+        reset_ids = [_mutation_id(mutation) for mutation in mutations
+                     if mutation[0] == "reset" and _mutation_id(mutation) is not None]
+        stored_ids = set()
+        if append_ids:
+            stored_ids.update(row.mutation_id for row in ConversationMessage.query.with_entities(
+                ConversationMessage.mutation_id).filter(ConversationMessage.mutation_id.in_(append_ids)))
+        if reset_ids:
+            stored_ids.update(row.mutation_id for row in Conversation.query.with_entities(
+                Conversation.mutation_id).filter(Conversation.mutation_id.in_(reset_ids)))
+        return stored_ids
+    
+    def save(self, user_data: Dict[str, Dict[str, Any]], user_ids: Iterable[str],
+             mutations: Optional[Dict[str, List]] = None) -> bool:
+        """Save the given users and their mutations in one transaction"""
+        mutations = mutations or {}
+        with app.app_context():
+            try:
+                for user_id in user_ids:
+                    if str(user_id) in user_data:
+                        self._save_user(str(user_id), user_data[str(user_id)], mutations.get(str(user_id), []))
+                db.session.commit()
+                return True
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Error saving users to the database: {e}")
+                return False
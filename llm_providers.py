@@ -0,0 +1,160 @@
+"""
+Chat completion backends. The character prompt is built in mistral_integration and sent as a
+provider-neutral request (messages, temperature, max_tokens, top_p, safe_prompt); each provider
+adds its model and talks to its own backend.
+"""
+
+import os
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import contextlib
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Which provider generates replies: "mistral" (default), "openai" (any OpenAI-compatible server) or "fake"
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "mistral")
+MISTRAL_MODEL = os.getenv("MISTRAL_MODEL", "mistral-medium")
+# OpenAI-compatible server, e.g. a local vLLM, llama.cpp or Ollama instance
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "http://localhost:8000/v1/chat/completions")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "default")
+# Fake provider: seconds before the first token, and tokens generated per second
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0.3"))
+FAKE_LLM_TOKENS_PER_SECOND = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "50"))
+
+class LLMProvider:
+    """Base class for chat completion backends"""
+    async def start(self) -> None:
+        """Open connections before the first request"""
+    
+    async def close(self) -> None:
+        """Close connections at shutdown"""
+    
+    async def complete(self, request: Dict) -> str:
+        """Return the reply text for a chat request"""
+        raise NotImplementedError
+    
+    async def stream(self, request: Dict) -> AsyncIterator[str]:
+        """Yield the reply text for a chat request in pieces as it is generated"""
+        # Providers that can't stream yield the whole reply at once
+        yield await self.complete(request)
+
+class MistralProvider(LLMProvider):
+    """Mistral's chat completions API over the shared, pooled Mistral client"""
+    def __init__(self, model: str = MISTRAL_MODEL):
+        self.model = model
+    
+    async def start(self) -> None:
+        # Imported here to avoid a circular import with mistral_integration
+        from mistral_integration import get_client
+        await get_client().start()
+    
+    async def close(self) -> None:
+        from mistral_integration import get_client
+        await get_client().close()
+    
+    async def complete(self, request: Dict) -> str:
+        from mistral_integration import _get_api_key, get_client
+        response_data = await get_client().chat_completion({**request, "model": self.model}, _get_api_key())
+        return response_data["choices"][0]["message"]["content"]
+    
+    async def stream(self, request: Dict) -> AsyncIterator[str]:
+        from mistral_integration import _get_api_key, get_client
+        stream = get_client().stream_chat_completion({**request, "model": self.model}, _get_api_key())
+        async with contextlib.aclosing(stream):
+            async for delta in stream:
+                yield delta
+
+class OpenAICompatibleProvider(LLMProvider):
+    """
+    Any server implementing OpenAI's chat completions API, e.g. a local model server.
+    Uses its own connection pool with the same timeouts, retries and circuit breaker as Mistral.
+    """
+    def __init__(self, api_url: str = OPENAI_API_URL, model: str = OPENAI_MODEL, api_key: Optional[str] = None):
+        from mistral_integration import MistralClient
+        self.model = model
+        self.api_key = api_key or os.getenv("OPENAI_API_KEY", "none")
+        self.client = MistralClient(api_url=api_url)
+    
+    def _payload(self, request: Dict) -> Dict:
+        # safe_prompt is Mistral's own option and other servers reject unknown fields
+        payload = {key: value for key, value in request.items() if key != "safe_prompt"}
+        payload["model"] = self.model
+        return payload
+    
+    async def start(self) -> None:
+        await self.client.start()
+    
+    async def close(self) -> None:
+        await self.client.close()
+    
+    async def complete(self, request: Dict) -> str:
+        response_data = await self.client.chat_completion(self._payload(request), self.api_key)
+        return response_data["choices"][0]["message"]["content"]
+    
+    async def stream(self, request: Dict) -> AsyncIterator[str]:
+        stream = self.client.stream_chat_completion(self._payload(request), self.api_key)
+        async with contextlib.aclosing(stream):
+            async for delta in stream:
+                yield delta
+
+class FakeProvider(LLMProvider):
+    """
+    In-process provider for load tests and offline runs: no network, a fixed delay before the
+    first token and a steady token rate. Replies are deterministic for a given message.
+    """
+    WORDS = (
+        "indeed", "quite", "fascinating", "I", "see", "what", "you", "mean", "*smiles*", "well",
+        "that", "is", "a", "curious", "thought", "tell", "me", "more", "hmm", "of", "course"
+    )
+    
+    def __init__(self, latency: float = FAKE_LLM_LATENCY, tokens_per_second: float = FAKE_LLM_TOKENS_PER_SECOND,
+                 reply_tokens: int = 40):
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply_tokens = reply_tokens
+    
+    def _reply_words(self, request: Dict) -> List[str]:
+        # Seed from the latest message so replaying a conversation gives the same replies
+        seed = hashlib.sha256(request["messages"][-1]["content"].encode("utf-8")).digest()
+        rng = random.Random(seed)
+        return [rng.choice(self.WORDS) for _ in range(min(self.reply_tokens, request.get("max_tokens", 1000)))]
+    
+    async def complete(self, request: Dict) -> str:
+        words = self._reply_words(request)
+        await asyncio.sleep(self.latency + len(words) / self.tokens_per_second)
+        return " ".join(words)
+    
+    async def stream(self, request: Dict) -> AsyncIterator[str]:
+        words = self._reply_words(request)
+        await asyncio.sleep(self.latency)
+        
+        # Sleep against a deadline so the token rate holds even if the consumer is slow
+        start = time.monotonic()
+        for index, word in enumerate(words):
+            delay = start + (index + 1) / self.tokens_per_second - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield word if index == 0 else f" {word}"
+
+_provider: Optional[LLMProvider] = None
+
+def get_provider() -> LLMProvider:
+    """Get the configured LLM provider"""
+    global _provider
+    if _provider is None:
+        if LLM_PROVIDER == "openai":
+            _provider = OpenAICompatibleProvider()
+        elif LLM_PROVIDER == "fake":
+            _provider = FakeProvider()
+        else:
+            _provider = MistralProvider()
+    return _provider
+
+def set_provider(provider: LLMProvider) -> None:
+    """Replace the LLM provider, e.g. with a FakeProvider in load tests"""
+    global _provider
+    _provider = provider
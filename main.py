@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from bot import setup_bot
 from dotenv import load_dotenv
@@ -30,8 +31,15 @@ def main():
     bot = setup_bot(telegram_token)
     logging.info("Bot started!")
     
-    # Run the bot until the user presses Ctrl-C
-    bot.run_polling(allowed_updates=["message", "callback_query"])
+    # Run the bot until the user presses Ctrl-C, receiving updates by webhook if one is configured
+    if os.getenv("WEBHOOK_URL"):
+        from webhook import run_webhook
+        try:
+            asyncio.run(run_webhook(bot, allowed_updates=["message", "callback_query"]))
+        except KeyboardInterrupt:
+            pass
+    else:
+        bot.run_polling(allowed_updates=["message", "callback_query"])
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,254 @@
+"""
+Long-term memory of messages evicted from the conversation history. Each (user, character)
+conversation gets an index of hashed bag-of-words vectors in a NumPy array, and the evicted
+messages most similar to the latest user message are added to the prompt on each turn.
+Memories are appended to data/memories/user_{id}.jsonl and indexes are loaded on first use.
+"""
+
+import os
+import re
+import json
+import zlib
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from data_storage import DATA_DIR, atomic_write_file
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Keep and retrieve long-term memories (needs numpy)
+LONG_TERM_MEMORY = os.getenv("LONG_TERM_MEMORY", "true").lower() == "true"
+# Memories added to the prompt per turn, and the minimum cosine similarity for a memory to count as relevant
+MEMORY_TOP_K = int(os.getenv("MEMORY_TOP_K", "3"))
+MEMORY_MIN_SCORE = float(os.getenv("MEMORY_MIN_SCORE", "0.2"))
+# Memories kept per conversation, and conversation indexes kept in memory
+MEMORY_MAX_PER_CONVERSATION = int(os.getenv("MEMORY_MAX_PER_CONVERSATION", "2000"))
+MEMORY_CACHED_INDEXES = int(os.getenv("MEMORY_CACHED_INDEXES", "64"))
+# Dimensions of the hashed vectors
+MEMORY_DIMENSIONS = int(os.getenv("MEMORY_DIMENSIONS", "256"))
+
+_WORD = re.compile(r"\w+")
+_STOP_WORDS = frozenset((
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "do", "for", "from", "have", "i", "if", "in",
+    "is", "it", "me", "my", "of", "on", "or", "so", "that", "the", "this", "to", "was", "we", "what",
+    "with", "you", "your"
+))
+
+def vectorize(texts: List[str], dimensions: int = MEMORY_DIMENSIONS) -> "np.ndarray":
+    """
+    Hash the words and word pairs of each text into a fixed-size, L2-normalised vector.
+    crc32 is used instead of hash() so vectors don't depend on the process's hash seed.
+    """
+    cells, values = [], []
+    for row, text in enumerate(texts):
+        words = [w for w in _WORD.findall(text.lower()) if w not in _STOP_WORDS]
+        offset = row * dimensions
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            cells.append(offset + h % dimensions)
+            # One hash bit picks the sign so colliding features tend to cancel out
+            values.append(1.0 if h & 0x80000000 else -1.0)
+    
+    # Sum the features of every text into its row in one pass
+    vectors = np.bincount(cells, weights=values, minlength=len(texts) * dimensions) \
+        .astype(np.float32).reshape(len(texts), dimensions)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.divide(vectors, norms, out=vectors, where=norms > 0)
+    return vectors
+
+class MemoryIndex:
+    """The memories of one conversation: their texts and vectors, oldest first"""
+    def __init__(self, max_memories: int = MEMORY_MAX_PER_CONVERSATION, dimensions: int = MEMORY_DIMENSIONS):
+        self.max_memories = max_memories
+        self.dimensions = dimensions
+        self.texts: List[str] = []
+        self._vectors = np.zeros((0, dimensions), dtype=np.float32)
+    
+    def __len__(self) -> int:
+        return len(self.texts)
+    
+    def add(self, texts: List[str]) -> None:
+        """Add memories, dropping the oldest ones beyond the limit"""
+        if not texts:
+            return
+        
+        count = len(self.texts)
+        if count + len(texts) > len(self._vectors):
+            # Grow geometrically so adding one memory at a time doesn't copy the array every time
+            needed = count + len(texts)
+            capacity = max(needed, min(2 * needed, self.max_memories), 64)
+            vectors = np.zeros((capacity, self.dimensions), dtype=np.float32)
+            vectors[:count] = self._vectors[:count]
+            self._vectors = vectors
+        
+        self._vectors[count:count + len(texts)] = vectorize(texts, self.dimensions)
+        self.texts.extend(texts)
+        
+        if len(self.texts) > self.max_memories:
+            # Drop a tenth more than needed, so the shift happens once per many additions
+            drop = len(self.texts) - self.max_memories + self.max_memories // 10
+            remaining = len(self.texts) - drop
+            self._vectors[:remaining] = self._vectors[drop:len(self.texts)]
+            del self.texts[:drop]
+    
+    def clear(self) -> None:
+        """Forget every memory"""
+        self.texts = []
+        self._vectors = np.zeros((0, self.dimensions), dtype=np.float32)
+    
+    def search(self, query: str, k: int = MEMORY_TOP_K, min_score: float = MEMORY_MIN_SCORE) -> List[str]:
+        """Get up to k memories most similar to the query, in the order they were added"""
+        count = len(self.texts)
+        if count == 0 or k <= 0:
+            return []
+        
+        scores = self._vectors[:count] @ vectorize([query], self.dimensions)[0]
+        if count > k:
+            top = np.argpartition(scores, count - k)[count - k:]
+        else:
+            top = np.arange(count)
+        return [self.texts[i] for i in sorted(top) if scores[i] >= min_score]
+
+class MemoryStore:
+    """
+    Memories of every conversation. New memories are appended to one JSON lines file per user
+    on a single background thread, which also loads indexes, so a load sees every memory
+    appended before it and later ones are applied once it finishes.
+    """
+    def __init__(self, data_dir: str = DATA_DIR, max_memories: int = MEMORY_MAX_PER_CONVERSATION,
+                 cached_indexes: int = MEMORY_CACHED_INDEXES):
+        self.memory_dir = os.path.join(data_dir, "memories")
+        os.makedirs(self.memory_dir, exist_ok=True)
+        self.max_memories = max_memories
+        self.cached_indexes = cached_indexes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memories")
+        self._indexes: "OrderedDict[Tuple[str, str], MemoryIndex]" = OrderedDict()
+        self._loading: Dict[Tuple[str, str], asyncio.Task] = {}
+        # Changes made while an index is loading, applied once it's loaded: a list of texts, or None for a reset
+        self._backlogs: Dict[Tuple[str, str], List[Optional[List[str]]]] = {}
+    
+    def _memory_file(self, user_id: str) -> str:
+        return os.path.join(self.memory_dir, f"user_{user_id}.jsonl")
+    
+    def add(self, user_id: int, character_id: str, messages: List[Dict]) -> None:
+        """Remember messages evicted from a conversation's history"""
+        texts = [f"{'User' if m['role'] == 'user' else 'You'}: {m['content']}" for m in messages]
+        if not texts:
+            return
+        
+        key = (str(user_id), character_id)
+        lines = "".join(json.dumps({"c": character_id, "t": text}) + "\n" for text in texts)
+        self._executor.submit(self._append, key[0], lines)
+        
+        if key in self._indexes:
+            self._indexes[key].add(texts)
+        elif key in self._backlogs:
+            self._backlogs[key].append(texts)
+    
+    def forget(self, user_id: int, character_id: str) -> None:
+        """Forget the memories of a conversation, e.g. when it is reset"""
+        key = (str(user_id), character_id)
+        self._executor.submit(self._append, key[0], json.dumps({"c": character_id, "reset": True}) + "\n")
+        
+        if key in self._indexes:
+            self._indexes[key].clear()
+        elif key in self._backlogs:
+            self._backlogs[key].append(None)
+    
+    async def search(self, user_id: int, character_id: str, query: str, k: int = MEMORY_TOP_K) -> List[str]:
+        """Get the memories of a conversation most relevant to the query"""
+        index = await self._get_index((str(user_id), character_id))
+        return index.search(query, k)
+    
+    async def _get_index(self, key: Tuple[str, str]) -> MemoryIndex:
+        index = self._indexes.get(key)
+        if index is not None:
+            self._indexes.move_to_end(key)
+            return index
+        
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = self._loading[key] = asyncio.ensure_future(self._load_index(key))
+        # Shielded so a cancelled reply doesn't abort a load that other replies may be waiting for
+        return await asyncio.shield(loading)
+    
+    async def _load_index(self, key: Tuple[str, str]) -> MemoryIndex:
+        self._backlogs[key] = []
+        try:
+            index = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_index, key)
+            for texts in self._backlogs[key]:
+                if texts is None:
+                    index.clear()
+                else:
+                    index.add(texts)
+            
+            self._indexes[key] = index
+            if len(self._indexes) > self.cached_indexes:
+                self._indexes.popitem(last=False)
+            return index
+        finally:
+            del self._backlogs[key]
+            del self._loading[key]
+    
+    def _append(self, user_id: str, lines: str) -> None:
+        """Append lines to a user's memory file (runs on the memory thread)"""
+        try:
+            with open(self._memory_file(user_id), "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.error(f"Error saving memories of user {user_id}: {str(e)}")
+    
+    def _read_index(self, key: Tuple[str, str]) -> MemoryIndex:
+        """Build a conversation's index from its user's memory file (runs on the memory thread)"""
+        user_id, character_id = key
+        memories: Dict[str, List[str]] = {}
+        lines = 0
+        try:
+            with open(self._memory_file(user_id), encoding="utf-8") as f:
+                for line in f:
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A line cut short by a crash
+                        continue
+                    if entry.get("reset"):
+                        memories.pop(entry["c"], None)
+                    else:
+                        memories.setdefault(entry["c"], []).append(entry["t"])
+        except FileNotFoundError:
+            pass
+        
+        for texts in memories.values():
+            del texts[:-self.max_memories]
+        
+        # Rewrite the file without forgotten and dropped memories once they make up most of it
+        kept = sum(len(texts) for texts in memories.values())
+        if lines > 2 * kept + 100:
+            atomic_write_file(self._memory_file(user_id), "".join(
+                json.dumps({"c": c, "t": text}) + "\n" for c, texts in memories.items() for text in texts
+            ))
+        
+        index = MemoryIndex(self.max_memories)
+        index.add(memories.get(character_id, []))
+        return index
+    
+    def close(self) -> None:
+        """Wait for pending appends and stop the memory thread"""
+        self._executor.shutdown(wait=True)
+
+def create_memory_store(data_dir: str = DATA_DIR) -> Optional[MemoryStore]:
+    """Create the memory store, or None if long-term memory is off or numpy isn't installed"""
+    if not LONG_TERM_MEMORY:
+        return None
+    if np is None:
+        logger.warning("numpy is not installed, long-term memory is disabled")
+        return None
+    return MemoryStore(data_dir)
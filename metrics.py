@@ -0,0 +1,101 @@
+"""
+In-process metrics: counters, gauges and latency summaries, plus an event loop lag
+monitor. Snapshots are logged periodically and served by the webhook server at /metrics.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds between metric snapshots written to the log (0 disables logging)
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "60"))
+# Seconds between event loop lag measurements
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+_counters: Dict[str, float] = {}
+_gauges: Dict[str, float] = {}
+_summaries: Dict[str, Dict[str, float]] = {}
+
+def increment(name: str, value: float = 1) -> None:
+    """Add to a counter"""
+    _counters[name] = _counters.get(name, 0) + value
+
+def set_gauge(name: str, value: float) -> None:
+    """Set a gauge to its current value"""
+    _gauges[name] = value
+
+def observe(name: str, value: float) -> None:
+    """Record an observation (e.g. a latency) in a count/sum/max summary"""
+    summary = _summaries.get(name)
+    if summary is None:
+        summary = _summaries[name] = {"count": 0, "sum": 0.0, "max": 0.0}
+    summary["count"] += 1
+    summary["sum"] += value
+    summary["max"] = max(summary["max"], value)
+
+def snapshot() -> Dict[str, Any]:
+    """Get the current value of every metric"""
+    return {
+        "counters": dict(_counters),
+        "gauges": dict(_gauges),
+        "summaries": {
+            name: {**summary, "avg": summary["sum"] / summary["count"] if summary["count"] else 0.0}
+            for name, summary in _summaries.items()
+        }
+    }
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes up a task that sleeps for a fixed interval.
+    Any blocking call on the loop (file or database I/O, heavy CPU work) shows up as lag,
+    recorded in the event_loop_lag_seconds summary and gauge.
+    """
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL, log_interval: float = METRICS_LOG_INTERVAL):
+        self.interval = interval
+        self.log_interval = log_interval
+        self._task: Optional[asyncio.Task] = None
+    
+    async def _run(self) -> None:
+        """Measure loop lag forever, logging a metrics snapshot every log_interval seconds"""
+        next_log = time.monotonic() + self.log_interval
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            
+            lag = max(0.0, now - expected)
+            observe("event_loop_lag_seconds", lag)
+            set_gauge("event_loop_lag_seconds", lag)
+            
+            if self.log_interval > 0 and now >= next_log:
+                logger.info(f"Metrics: {snapshot()}")
+                next_log = now + self.log_interval
+    
+    def start(self) -> None:
+        """Start monitoring on the running event loop"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+    
+    async def stop(self) -> None:
+        """Stop monitoring"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+_loop_lag_monitor = EventLoopLagMonitor()
+
+def start_loop_lag_monitor() -> None:
+    """Start the process-wide event loop lag monitor"""
+    _loop_lag_monitor.start()
+
+async def stop_loop_lag_monitor() -> None:
+    """Stop the process-wide event loop lag monitor"""
+    await _loop_lag_monitor.stop()
@@ -1,94 +1,536 @@
 import os
 import json
+import time
+import asyncio
+import hashlib
+import contextlib
 import logging
 import random
-from typing import Dict, List, Tuple
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple, TypeVar
 import aiohttp
+from llm_providers import get_provider
+from metrics import increment, set_gauge
+from response_cache import get_response_cache
+from token_budget import CONTEXT_TOKEN_BUDGET, estimate_tokens, fit_history_to_budget, message_tokens
 
 logger = logging.getLogger(__name__)
 
-MISTRAL_API_URL = "https://api.mistral.ai/v1/chat/completions"
+T = TypeVar("T")
+
+MISTRAL_API_URL = os.getenv("MISTRAL_API_URL", "https://api.mistral.ai/v1/chat/completions")
+
+# Statuses worth retrying: rate limiting and provider-side failures
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+class MistralAPIError(Exception):
+    """A Mistral API request failed"""
+    def __init__(self, message: str, status: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+    
+    @property
+    def retryable(self) -> bool:
+        """Whether the request may succeed if sent again"""
+        return self.status is None or self.status in RETRYABLE_STATUSES
+
+class MistralUnavailableError(MistralAPIError):
+    """The circuit breaker is open, so the request wasn't sent"""
+
+class CircuitBreaker:
+    """
+    Fails requests fast after too many consecutive failures, so handlers don't pile up
+    waiting on a degraded provider. After the cooldown one probe request is let through
+    per cooldown period; the first success closes the circuit again.
+    """
+    def __init__(self, failure_threshold: int, cooldown: float):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+    
+    @property
+    def is_open(self) -> bool:
+        return self._opened_at is not None
+    
+    def allow_request(self) -> bool:
+        """Check whether a request may be sent now"""
+        if self._opened_at is None:
+            return True
+        
+        if time.monotonic() - self._opened_at >= self.cooldown:
+            # Half-open: let this request probe the provider and hold back the rest for another cooldown
+            self._opened_at = time.monotonic()
+            return True
+        
+        return False
+    
+    def record_success(self) -> None:
+        """Record a request the provider answered, closing the circuit"""
+        if self._opened_at is not None:
+            logger.info("Mistral API recovered, closing the circuit")
+            set_gauge("mistral_circuit_open", 0)
+        self._failures = 0
+        self._opened_at = None
+    
+    def record_failure(self) -> None:
+        """Record a failed request, opening the circuit once the threshold is reached"""
+        self._failures += 1
+        if self._failures >= self.failure_threshold:
+            if self._opened_at is None:
+                logger.warning(f"Mistral API failed {self._failures} times in a row, opening the circuit "
+                               f"for {self.cooldown}s")
+                increment("mistral_circuit_opened")
+                set_gauge("mistral_circuit_open", 1)
+            self._opened_at = time.monotonic()
+
+class MistralClient:
+    """
+    Long-lived HTTP client for the Mistral API.
+    Keeps one pooled aiohttp session so chat turns reuse open keep-alive connections
+    instead of doing a new TCP and TLS handshake each time. Requests time out, are retried
+    with exponential backoff and jitter on rate limiting and provider failures, and go through
+    a circuit breaker.
+    """
+    def __init__(self, api_url: str = MISTRAL_API_URL, limit_per_host: Optional[int] = None,
+                 keepalive_timeout: Optional[float] = None, dns_cache_ttl: Optional[int] = None,
+                 request_timeout: Optional[float] = None, connect_timeout: Optional[float] = None,
+                 max_retries: Optional[int] = None, backoff_base: Optional[float] = None,
+                 backoff_max: Optional[float] = None, circuit_breaker: Optional[CircuitBreaker] = None):
+        self.api_url = api_url
+        self.limit_per_host = limit_per_host or int(os.getenv("MISTRAL_POOL_LIMIT_PER_HOST", "20"))
+        self.keepalive_timeout = keepalive_timeout or float(os.getenv("MISTRAL_KEEPALIVE_TIMEOUT", "60"))
+        self.dns_cache_ttl = dns_cache_ttl or int(os.getenv("MISTRAL_DNS_CACHE_TTL", "300"))
+        self.request_timeout = request_timeout or float(os.getenv("MISTRAL_REQUEST_TIMEOUT", "60"))
+        self.connect_timeout = connect_timeout or float(os.getenv("MISTRAL_CONNECT_TIMEOUT", "10"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("MISTRAL_MAX_RETRIES", "3"))
+        self.backoff_base = backoff_base or float(os.getenv("MISTRAL_BACKOFF_BASE", "0.5"))
+        self.backoff_max = backoff_max or float(os.getenv("MISTRAL_BACKOFF_MAX", "10"))
+        self.circuit_breaker = circuit_breaker or CircuitBreaker(
+            int(os.getenv("MISTRAL_BREAKER_THRESHOLD", "5")),
+            float(os.getenv("MISTRAL_BREAKER_COOLDOWN", "30"))
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+    
+    async def start(self) -> None:
+        """Open the pooled session"""
+        if self._session is not None and not self._session.closed:
+            return
+        
+        connector = aiohttp.TCPConnector(
+            limit_per_host=self.limit_per_host,
+            keepalive_timeout=self.keepalive_timeout,
+            ttl_dns_cache=self.dns_cache_ttl,
+            use_dns_cache=True
+        )
+        self._session = aiohttp.ClientSession(connector=connector)
+    
+    async def close(self) -> None:
+        """Close the pooled session and its connections"""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+    
+    async def chat_completion(self, payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        """Send a chat completion request and return the decoded response"""
+        await self.start()
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {api_key}"
+        }
+        
+        # The whole request, including reading the body, must finish within the timeout
+        timeout = aiohttp.ClientTimeout(total=self.request_timeout, sock_connect=self.connect_timeout)
+        
+        async def attempt() -> Dict[str, Any]:
+            async with await self._post(payload, headers, timeout) as response:
+                try:
+                    return await response.json()
+                except asyncio.CancelledError:
+                    # Nobody will read the answer, so abort the request instead of reading it to the end
+                    response.close()
+                    raise
+        
+        return await self._with_retries(attempt)
+    
+    async def stream_chat_completion(self, payload: Dict[str, Any], api_key: str) -> AsyncIterator[str]:
+        """Send a streaming chat completion request and yield text deltas as they arrive"""
+        await self.start()
+        
+        headers = {
+            "Content-Type": "application/json",
+            "Accept": "text/event-stream",
+            "Authorization": f"Bearer {api_key}"
+        }
+        
+        # A stream may take long overall, so the timeout applies to the wait for each chunk instead
+        timeout = aiohttp.ClientTimeout(sock_connect=self.connect_timeout, sock_read=self.request_timeout)
+        
+        # Only opening the stream is retried; once text was yielded it can't be taken back
+        response = await self._with_retries(lambda: self._post({**payload, "stream": True}, headers, timeout))
+        
+        async with response:
+            try:
+                # Server-sent events: one "data: {json}" line per chunk, ending with "data: [DONE]"
+                async for raw_line in response.content:
+                    line = raw_line.decode("utf-8").strip()
+                    if not line.startswith("data:"):
+                        continue
+                    
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    
+                    chunk = json.loads(data)
+                    delta = chunk["choices"][0].get("delta", {}).get("content")
+                    if delta:
+                        yield delta
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.circuit_breaker.record_failure()
+                raise MistralAPIError(f"Mistral API stream failed: {e!r}") from e
+            except (asyncio.CancelledError, GeneratorExit):
+                # The reply was cancelled or abandoned, so abort the stream instead of reading it to the end
+                response.close()
+                raise
+    
+    async def _post(self, payload: Dict[str, Any], headers: Dict[str, str],
+                    timeout: aiohttp.ClientTimeout) -> aiohttp.ClientResponse:
+        """Send one request and return the response, raising MistralAPIError if it isn't a success"""
+        response = await self._session.post(self.api_url, json=payload, headers=headers, timeout=timeout)
+        if response.status == 200:
+            return response
+        
+        try:
+            error_text = await response.text()
+        finally:
+            response.release()
+        
+        logger.error(f"Mistral API error: {error_text}")
+        raise MistralAPIError(f"Mistral API error: {response.status}", response.status,
+                              _parse_retry_after(response.headers.get("Retry-After")))
+    
+    async def _with_retries(self, attempt: Callable[[], Awaitable[T]]) -> T:
+        """Run a request attempt, retrying failures that may be temporary"""
+        attempt_number = 0
+        while True:
+            if not self.circuit_breaker.allow_request():
+                increment("mistral_circuit_rejected")
+                raise MistralUnavailableError("Mistral API is unavailable, the circuit is open")
+            
+            try:
+                result = await attempt()
+            except MistralAPIError as e:
+                if not e.retryable:
+                    # The provider is up and rejected the request itself, so retrying won't help
+                    self.circuit_breaker.record_success()
+                    raise
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = MistralAPIError(f"Mistral API request failed: {e!r}")
+                error.__cause__ = e
+            else:
+                self.circuit_breaker.record_success()
+                return result
+            
+            self.circuit_breaker.record_failure()
+            increment("mistral_request_failures")
+            
+            if attempt_number == self.max_retries:
+                raise error
+            
+            # Honour Retry-After, but give up rather than hold the handler longer than the backoff cap
+            if error.retry_after is not None:
+                if error.retry_after > self.backoff_max:
+                    raise error
+                delay = error.retry_after
+            else:
+                # Exponential backoff with full jitter so retries from many chats don't line up
+                delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt_number))
+            
+            logger.warning(f"{error}, retrying in {delay:.2f}s ({attempt_number + 1}/{self.max_retries})")
+            increment("mistral_retries")
+            await asyncio.sleep(delay)
+            attempt_number += 1
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+# The process-wide client, started with the bot and closed at shutdown
+_client: Optional[MistralClient] = None
+
+def get_client() -> MistralClient:
+    """Get the process-wide Mistral client"""
+    global _client
+    if _client is None:
+        _client = MistralClient()
+    return _client
+
+async def start_client() -> None:
+    """Open the configured LLM provider's connections"""
+    await get_provider().start()
+
+async def close_client() -> None:
+    """Close the configured LLM provider's connections"""
+    await get_provider().close()
 
 async def generate_response(
     character: Dict, 
     conversation_history: List[Dict], 
-    character_stats: Dict
+    character_stats: Dict,
+    conversation_summary: Optional[str] = None,
+    character_id: Optional[str] = None,
+    memories: Optional[List[str]] = None
 ) -> Tuple[str, float]:
     """
-    Generate a response from the character using Mistral AI
+    Generate a response from the character using the configured LLM provider
     
     Args:
         character: The character data
         conversation_history: The conversation history
         character_stats: The character's mood and personality stats
+        conversation_summary: Summary of earlier messages no longer in the history
+        character_id: The character's ID, used to cache its prompt
+        memories: Earlier messages relevant to the latest one, recalled from long-term memory
     
     Returns:
         Tuple of (response text, mood change)
     """
-    # Get the Mistral API key from environment variable
+    # Openers like "hi" to a character are answered from the response cache when it's enabled
+    response_cache = get_response_cache()
+    cache_key = response_cache and response_cache.key_for(character_id, character, conversation_history,
+                                                          conversation_summary)
+    if cache_key:
+        response_text = response_cache.get(cache_key)
+        if response_text is not None:
+            return response_text, calculate_mood_change(response_text)
+    
+    request = _build_payload(character, conversation_history, character_stats, conversation_summary, character_id,
+                             memories)
+    
+    response_text = await get_provider().complete(request)
+    
+    if cache_key:
+        response_cache.put(cache_key, response_text)
+    
+    return response_text, calculate_mood_change(response_text)
+
+async def generate_response_stream(
+    character: Dict, 
+    conversation_history: List[Dict], 
+    character_stats: Dict,
+    conversation_summary: Optional[str] = None,
+    character_id: Optional[str] = None,
+    memories: Optional[List[str]] = None
+) -> AsyncIterator[str]:
+    """
+    Generate a response from the character using the configured LLM provider, streaming it as it is produced
+    
+    Args:
+        character: The character data
+        conversation_history: The conversation history
+        character_stats: The character's mood and personality stats
+        conversation_summary: Summary of earlier messages no longer in the history
+        character_id: The character's ID, used to cache its prompt
+        memories: Earlier messages relevant to the latest one, recalled from long-term memory
+    
+    Yields:
+        Pieces of the response text in order
+    """
+    # Openers like "hi" to a character are answered from the response cache when it's enabled
+    response_cache = get_response_cache()
+    cache_key = response_cache and response_cache.key_for(character_id, character, conversation_history,
+                                                          conversation_summary)
+    if cache_key:
+        response_text = response_cache.get(cache_key)
+        if response_text is not None:
+            yield response_text
+            return
+    
+    request = _build_payload(character, conversation_history, character_stats, conversation_summary, character_id,
+                             memories)
+    
+    pieces = []
+    async with contextlib.aclosing(get_provider().stream(request)) as stream:
+        async for delta in stream:
+            pieces.append(delta)
+            yield delta
+    
+    # Only complete replies are cached
+    if cache_key:
+        response_cache.put(cache_key, "".join(pieces))
+
+def calculate_mood_change(response_text: str) -> float:
+    """
+    Calculate a random mood change based on the conversation
+    This is a simple implementation - in a more advanced system, this would
+    use sentiment analysis or more complex logic
+    """
+    return random.uniform(-0.5, 0.5)
+
+def _get_api_key() -> str:
+    """Get the Mistral API key from environment variable"""
     api_key = os.getenv("MISTRAL_API_KEY")
     if not api_key:
         raise ValueError("MISTRAL_API_KEY environment variable not set!")
+    return api_key
+
+def _build_payload(character: Dict, conversation_history: List[Dict], character_stats: Dict,
+                   conversation_summary: Optional[str] = None, character_id: Optional[str] = None,
+                   memories: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Build the provider-neutral chat request for a character and conversation; the provider adds its model"""
+    # The character's system prompt stays byte-identical between turns so providers can cache it as a prefix
+    system_prompt = _prepare_system_prompt(character, character_stats, character_id)
     
-    # Prepare the system prompt with character info and current stats
-    system_prompt = _prepare_system_prompt(character, character_stats)
+    # Current mood, conversation count, the summary of earlier messages and recalled memories change every turn.
+    # The newest message is always sent whole, so when it doesn't fit next to the state, leave out the
+    # recalled memories and then the summary
+    newest_tokens = message_tokens(conversation_history[-1]) if conversation_history else 0
+    for summary, recalled in ((conversation_summary, memories), (conversation_summary, None), (None, None)):
+        state_block = _prepare_state_block(character_stats, summary, recalled)
+        history_budget = CONTEXT_TOKEN_BUDGET - estimate_tokens(system_prompt) - estimate_tokens(state_block)
+        if history_budget >= newest_tokens:
+            break
     
-    # Prepare the messages for the Mistral API
-    messages = [{"role": "system", "content": system_prompt}]
+    # Add as much of the conversation history as fits in the token budget
+    history = fit_history_to_budget(conversation_history, history_budget)
     
-    # Add the conversation history
-    for message in conversation_history:
-        messages.append({"role": message["role"], "content": message["content"]})
+    # Prepare the messages for the Mistral API, with the state just before the latest user message
+    # so everything ahead of it is unchanged from the previous turn
+    messages = [{"role": "system", "content": system_prompt}]
+    state_message = {"role": "system", "content": state_block}
+    if history and history[-1]["role"] == "user":
+        messages.extend(history[:-1])
+        messages.append(state_message)
+        messages.append(history[-1])
+    else:
+        messages.extend(history)
+        messages.append(state_message)
     
     # Check if NSFW mode is enabled for this character
     nsfw_mode = character.get("nsfw", False)
     
     # Prepare the request payload
-    payload = {
-        "model": "mistral-medium",  # Using Mistral Medium model
+    return {
         "messages": messages,
         "temperature": 0.7,  # A moderate temperature for good creativity but consistent responses
         "max_tokens": 1000,  # Limit response length
         "top_p": 0.9,
         "safe_prompt": not nsfw_mode  # Enable safety filters only if NSFW mode is disabled
     }
+
+class PromptCache:
+    """
+    LRU cache of character system prompts, which only depend on the character, its version
+    and NSFW mode, so they aren't rebuilt on every message
+    """
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple, Tuple[str, str]]" = OrderedDict()
     
-    # Make the API call
-    async with aiohttp.ClientSession() as session:
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {api_key}"
-        }
-        
-        async with session.post(MISTRAL_API_URL, json=payload, headers=headers) as response:
-            if response.status != 200:
-                error_text = await response.text()
-                logger.error(f"Mistral API error: {error_text}")
-                raise Exception(f"Mistral API error: {response.status}")
-            
-            response_data = await response.json()
-            
-            # Extract the response text
-            response_text = response_data["choices"][0]["message"]["content"]
-            
-            # Calculate a random mood change based on the conversation
-            # This is a simple implementation - in a more advanced system, this would
-            # use sentiment analysis or more complex logic
-            mood_change = random.uniform(-0.5, 0.5)
-            
-            return response_text, mood_change
+    def get(self, key: Tuple) -> Optional[Tuple[str, str]]:
+        """Get a cached prompt and its hash, marking it as recently used"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+    
+    def put(self, key: Tuple, entry: Tuple[str, str]) -> None:
+        """Cache a prompt and its hash, evicting the least recently used entry if full"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+    
+    def invalidate(self, character_id: str) -> None:
+        """Drop every cached prompt of a character"""
+        for key in [key for key in self._entries if key[0] == character_id]:
+            del self._entries[key]
+
+_prompt_cache = PromptCache(int(os.getenv("PROMPT_CACHE_SIZE", "512")))
 
-def _prepare_system_prompt(character: Dict, character_stats: Dict) -> str:
+# Hash of the last system prompt sent for each character, to track how often the prefix is reused
+_last_prefix_hashes: Dict[str, str] = {}
+
+def invalidate_prompt_cache(character_id: str) -> None:
+    """Drop cached prompts of a character after it was edited or its NSFW mode changed"""
+    _prompt_cache.invalidate(character_id)
+
+def _prepare_system_prompt(character: Dict, character_stats: Dict, character_id: Optional[str] = None) -> str:
     """
-    Prepare the system prompt for the Mistral API, including character info and current stats
+    Prepare the system prompt for the Mistral API with the character's info. It only changes when
+    the character does, so providers can reuse it as a cached prefix; see _prepare_state_block
+    for the parts that change every turn.
     
     Args:
         character: The character data
         character_stats: The character's mood and personality stats
+        character_id: The character's ID, used to cache the prompt
     
     Returns:
         The system prompt
     """
+    # Characters without their own traits show the user's stats, which can't be shared in the cache
+    if character_id is not None and "traits" in character:
+        key = (character_id, character.get("version", 0), character.get("nsfw", False))
+        entry = _prompt_cache.get(key)
+        if entry is None:
+            increment("prompt_cache_misses")
+            system_prompt = _build_system_prompt(character, character_stats)
+            entry = (system_prompt, hashlib.sha256(system_prompt.encode("utf-8")).hexdigest())
+            _prompt_cache.put(key, entry)
+        else:
+            increment("prompt_cache_hits")
+        system_prompt, prefix_hash = entry
+    else:
+        system_prompt = _build_system_prompt(character, character_stats)
+        prefix_hash = hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()
+    
+    # Count whether this character's prefix is the same as in its previous request
+    if character_id is not None:
+        previous_hash = _last_prefix_hashes.get(character_id)
+        if previous_hash == prefix_hash:
+            increment("prompt_prefix_reused")
+        else:
+            increment("prompt_prefix_changed")
+            _last_prefix_hashes[character_id] = prefix_hash
+            logger.debug(f"System prompt prefix of {character_id} is now {prefix_hash[:12]}")
+    
+    return system_prompt
+
+def _prepare_state_block(character_stats: Dict, conversation_summary: Optional[str] = None,
+                         memories: Optional[List[str]] = None) -> str:
+    """Prepare the character's current state, which is sent late in the messages since it changes every turn"""
+    state_block = (
+        f"Current state:\n"
+        f"- Mood: {_get_mood_description(character_stats['mood'])}\n"
+        f"- Conversation count: {character_stats['conversation_count']}\n"
+    )
+    
+    # Stand in for the messages that were evicted from the history
+    if conversation_summary:
+        state_block += f"\nEarlier in this conversation:\n{conversation_summary}\n"
+    
+    # Specific earlier messages that relate to what the user just said
+    if memories:
+        state_block += "\nYou remember these earlier messages:\n" + "".join(f"- {m}\n" for m in memories)
+    
+    return state_block
+
+def _build_system_prompt(character: Dict, character_stats: Dict) -> str:
+    """Build the system prompt from the character's description, traits and guidelines"""
     # Check if NSFW mode is enabled for this character
     nsfw_mode = character.get("nsfw", False)
     
@@ -110,9 +552,7 @@ def _prepare_system_prompt(character: Dict, character_stats: Dict) -> str:
             "Follow the user's lead regarding the level of maturity in the conversation."
         )
     
-    # Add current mood and personality traits
-    mood_description = _get_mood_description(character_stats["mood"])
-    
+    # Add personality traits
     traits_info = "Personality traits:\n"
     if "traits" in character:
         for trait, value in character["traits"].items():
@@ -126,12 +566,6 @@ def _prepare_system_prompt(character: Dict, character_stats: Dict) -> str:
             f"- Energy: {character_stats['personality_stats']['energy']}/10\n"
         )
     
-    current_state = (
-        f"\nCurrent state:\n"
-        f"- Mood: {mood_description}\n"
-        f"- Conversation count: {character_stats['conversation_count']}\n"
-    )
-    
     # Add guidelines for response structure
     guidelines = "\nGuidelines:\n"
     
@@ -155,7 +589,7 @@ def _prepare_system_prompt(character: Dict, character_stats: Dict) -> str:
             "6. Keep all content appropriate and avoid mature themes\n"
         )
     
-    return f"{base_prompt}\n\n{traits_info}{current_state}{guidelines}"
+    return f"{base_prompt}\n\n{traits_info}{guidelines}"
 
 def _get_mood_description(mood_value: int) -> str:
     """Convert a numeric mood value to a text description"""
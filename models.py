@@ -1,12 +1,20 @@
+import logging
 from app import db
 from datetime import datetime
+from sqlalchemy import BigInteger, inspect, text
+
+logger = logging.getLogger(__name__)
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    telegram_id = db.Column(db.Integer, unique=True)
+    # Telegram ids no longer fit in 32 bits
+    telegram_id = db.Column(db.BigInteger, unique=True, index=True)
     username = db.Column(db.String(64))
     first_name = db.Column(db.String(64))
     last_name = db.Column(db.String(64))
+    selected_character = db.Column(db.String(64))
+    # IDs of the custom characters created by this user, as a JSON list
+    custom_characters_json = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     
@@ -18,12 +26,21 @@ class Conversation(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     character_id = db.Column(db.String(64), nullable=False)
     total_messages = db.Column(db.Integer, default=0)
+    # Running summary of messages evicted from the history, as JSON
+    summary_json = db.Column(db.Text)
+    # Id of the reset that started this conversation, so a replayed reset isn't stored twice
+    mutation_id = db.Column(db.String(32))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     last_active = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationship to user
     user = db.relationship('User', backref=db.backref('conversations', lazy=True))
     
+    __table_args__ = (
+        db.Index('ix_conversation_user_character', 'user_id', 'character_id'),
+        db.Index('ix_conversation_mutation_id', 'mutation_id', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Conversation {self.user_id}:{self.character_id}>'
 
@@ -32,11 +49,19 @@ class ConversationMessage(db.Model):
     conversation_id = db.Column(db.Integer, db.ForeignKey('conversation.id'), nullable=False)
     role = db.Column(db.String(10), nullable=False)  # 'user' or 'assistant'
     content = db.Column(db.Text, nullable=False)
+    tokens = db.Column(db.Integer)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    # Id of the change that added this message, so a replayed change isn't stored twice
+    mutation_id = db.Column(db.String(32))
     
     # Relationship to conversation
     conversation = db.relationship('Conversation', backref=db.backref('messages', lazy=True))
     
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp', 'conversation_id', 'timestamp'),
+        db.Index('ix_message_mutation_id', 'mutation_id', unique=True),
+    )
+    
     def __repr__(self):
         return f'<Message {self.conversation_id}:{self.role}>'
 
@@ -54,5 +79,51 @@ class CharacterStat(db.Model):
     # Relationship to user
     user = db.relationship('User', backref=db.backref('character_stats', lazy=True))
     
+    __table_args__ = (
+        db.Index('ix_character_stat_user_character', 'user_id', 'character_id', unique=True),
+    )
+    
     def __repr__(self):
-        return f'<CharacterStat {self.user_id}:{self.character_id}>'
\ No newline at end of file
+        return f'<CharacterStat {self.user_id}:{self.character_id}>'
+
+def upgrade_schema() -> None:
+    """
+    Bring tables created by earlier versions of these models up to date. db.create_all() only
+    creates missing tables, so add the columns and indexes added to existing tables since, and
+    widen telegram_id where the database distinguishes 32 and 64 bit integers. Every step is
+    skipped when it has already been applied. Must run in an app context, after db.create_all().
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    quote = engine.dialect.identifier_preparer.quote
+    
+    for table in db.metadata.sorted_tables:
+        existing_columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            existing = existing_columns.get(column.name)
+            if existing is None:
+                # New columns are nullable without defaults, so existing rows just read None
+                column_type = column.type.compile(dialect=engine.dialect)
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {quote(table.name)} "
+                                            f"ADD COLUMN {quote(column.name)} {column_type}"))
+                logger.info(f"Added column {table.name}.{column.name}")
+            elif isinstance(column.type, BigInteger) and engine.dialect.name != "sqlite" \
+                    and not isinstance(existing["type"], BigInteger):
+                # SQLite integers are 64 bit already
+                with engine.begin() as connection:
+                    connection.execute(text(f"ALTER TABLE {quote(table.name)} ALTER COLUMN {quote(column.name)} "
+                                            f"TYPE {column.type.compile(dialect=engine.dialect)}"))
+                logger.info(f"Widened column {table.name}.{column.name} to 64 bits")
+        
+        existing_indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing_indexes:
+                continue
+            try:
+                with engine.begin() as connection:
+                    index.create(connection)
+                logger.info(f"Created index {index.name}")
+            except Exception as e:
+                # e.g. duplicate rows in the way of a unique index; the store works without it, only slower
+                logger.error(f"Error creating index {index.name}: {e}")
@@ -0,0 +1,140 @@
+"""
+Admission control in front of response generation: a token bucket per Telegram user, so one
+user flooding messages can't use up the Mistral quota, and a global bucket for the whole bot.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional
+from metrics import increment, observe, set_gauge
+
+logger = logging.getLogger(__name__)
+
+# Responses each user may request per minute, and how many they may send in a burst (0 disables)
+RATE_LIMIT_USER_PER_MINUTE = float(os.getenv("RATE_LIMIT_USER_PER_MINUTE", "20"))
+RATE_LIMIT_USER_BURST = float(os.getenv("RATE_LIMIT_USER_BURST", "5"))
+# Responses the whole bot may request per second, and the burst allowed on top (0 disables)
+RATE_LIMIT_GLOBAL_PER_SECOND = float(os.getenv("RATE_LIMIT_GLOBAL_PER_SECOND", "5"))
+RATE_LIMIT_GLOBAL_BURST = float(os.getenv("RATE_LIMIT_GLOBAL_BURST", "20"))
+# Longest a request waits in line for the global bucket before it's rejected
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))
+
+class TokenBucket:
+    """
+    Token bucket refilled at a steady rate up to its capacity. Tokens can be reserved ahead,
+    leaving the bucket in debt; later requests then wait in line behind the reservation.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    def try_acquire(self) -> bool:
+        """Take a token if one is available now"""
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+    
+    def reserve(self, max_wait: float) -> Optional[float]:
+        """
+        Reserve a token, returning the seconds to wait until it is available,
+        or None without reserving anything if that would be longer than max_wait
+        """
+        self._refill()
+        wait = max(0.0, (1 - self.tokens) / self.rate)
+        if wait > max_wait:
+            return None
+        self.tokens -= 1
+        return wait
+    
+    def is_full(self) -> bool:
+        """Whether the bucket has refilled completely, so forgetting it changes nothing"""
+        self._refill()
+        return self.tokens >= self.capacity
+
+class RateLimiter:
+    """
+    Per-user and global admission control. Users over their own limit are rejected at once;
+    requests over the global limit wait in line for up to max_wait seconds.
+    """
+    def __init__(self, user_per_minute: float = RATE_LIMIT_USER_PER_MINUTE,
+                 user_burst: float = RATE_LIMIT_USER_BURST,
+                 global_per_second: float = RATE_LIMIT_GLOBAL_PER_SECOND,
+                 global_burst: float = RATE_LIMIT_GLOBAL_BURST,
+                 max_wait: float = RATE_LIMIT_MAX_WAIT):
+        self.user_rate = user_per_minute / 60
+        self.user_burst = max(1.0, user_burst)
+        self.max_wait = max_wait
+        self.global_bucket = (
+            TokenBucket(global_per_second, max(1.0, global_burst)) if global_per_second > 0 else None
+        )
+        self._user_buckets: Dict[int, TokenBucket] = {}
+        self._prune_at = 1000
+    
+    async def acquire(self, user_id: int) -> bool:
+        """Admit a request from a user, waiting for global capacity if needed. Returns False if rejected."""
+        if self.user_rate > 0:
+            bucket = self._user_buckets.get(user_id)
+            if bucket is None:
+                self._prune_user_buckets()
+                bucket = self._user_buckets[user_id] = TokenBucket(self.user_rate, self.user_burst)
+                set_gauge("rate_limit_user_buckets", len(self._user_buckets))
+            
+            if not bucket.try_acquire():
+                increment("rate_limit_rejected_user")
+                return False
+        
+        if self.global_bucket is not None:
+            wait = self.global_bucket.reserve(self.max_wait)
+            set_gauge("rate_limit_global_tokens", self.global_bucket.tokens)
+            if wait is None:
+                # Give the user their token back, they didn't get a response for it
+                if self.user_rate > 0:
+                    bucket.tokens += 1
+                increment("rate_limit_rejected_global")
+                return False
+            
+            if wait > 0:
+                increment("rate_limit_queued")
+                observe("rate_limit_wait_seconds", wait)
+                try:
+                    await asyncio.sleep(wait)
+                except asyncio.CancelledError:
+                    # The reply was cancelled while waiting in line, so it never reaches Mistral
+                    self.global_bucket.tokens += 1
+                    if self.user_rate > 0:
+                        bucket.tokens += 1
+                    raise
+        
+        increment("rate_limit_admitted")
+        return True
+    
+    def _prune_user_buckets(self) -> None:
+        """Forget users whose buckets refilled, so idle users don't use memory"""
+        if len(self._user_buckets) < self._prune_at:
+            return
+        for user_id in [user_id for user_id, bucket in self._user_buckets.items() if bucket.is_full()]:
+            del self._user_buckets[user_id]
+        
+        # Scan again only after the number of users doubled, so pruning stays cheap per user
+        self._prune_at = max(1000, 2 * len(self._user_buckets))
+
+# The process-wide limiter shared by every handler
+_rate_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """Get the process-wide rate limiter"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter()
+    return _rate_limiter
@@ -0,0 +1,99 @@
+"""
+Cache of replies to conversation openers like "hi" or "hello". Several replies are kept per
+opener and handed out in turn, so a cached greeting doesn't feel canned, and each entry expires
+after a TTL so the variants are refreshed.
+"""
+
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+from metrics import increment, set_gauge
+
+# Cache replies to opening turns (off by default)
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "false").lower() == "true"
+# Number of cached openers, seconds before an opener's replies expire, and replies kept per opener
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_VARIANTS = int(os.getenv("RESPONSE_CACHE_VARIANTS", "3"))
+# Only conversations with at most this many user messages and no replies yet are cached
+RESPONSE_CACHE_MAX_MESSAGES = int(os.getenv("RESPONSE_CACHE_MAX_MESSAGES", "1"))
+# Openers longer than this aren't greetings and are unlikely to repeat
+RESPONSE_CACHE_MAX_CHARS = int(os.getenv("RESPONSE_CACHE_MAX_CHARS", "40"))
+
+_NON_WORD = re.compile(r"[^\w]+")
+
+def normalize_message(text: str) -> str:
+    """Reduce a message to lowercase words, so "Hi!!" and "hi" share a cache entry"""
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+class ResponseCache:
+    """LRU cache of reply variants per (character, version, NSFW mode, normalised opening messages)"""
+    def __init__(self, maxsize: int = RESPONSE_CACHE_SIZE, ttl: float = RESPONSE_CACHE_TTL,
+                 variants: int = RESPONSE_CACHE_VARIANTS):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.variants = variants
+        # key -> [created at, replies, index of the next reply to hand out]
+        self._entries: "OrderedDict[Tuple, list]" = OrderedDict()
+    
+    def key_for(self, character_id: Optional[str], character: Dict, conversation_history: List[Dict],
+                conversation_summary: Optional[str] = None) -> Optional[Tuple]:
+        """Get the cache key of a conversation, or None if it isn't a cacheable opening turn"""
+        if character_id is None or conversation_summary or not conversation_history:
+            return None
+        if len(conversation_history) > RESPONSE_CACHE_MAX_MESSAGES:
+            return None
+        if any(m["role"] != "user" or len(m["content"]) > RESPONSE_CACHE_MAX_CHARS for m in conversation_history):
+            return None
+        
+        messages = tuple(normalize_message(m["content"]) for m in conversation_history)
+        return (character_id, character.get("version", 0), character.get("nsfw", False), messages)
+    
+    def get(self, key: Tuple) -> Optional[str]:
+        """
+        Get the next cached reply for a key. Returns None until all variants were generated,
+        so the first few conversations still get fresh replies to rotate through.
+        """
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            entry = None
+        
+        if entry is None or len(entry[1]) < self.variants:
+            increment("response_cache_misses")
+            return None
+        
+        self._entries.move_to_end(key)
+        reply = entry[1][entry[2] % len(entry[1])]
+        entry[2] += 1
+        increment("response_cache_hits")
+        return reply
+    
+    def put(self, key: Tuple, reply: str) -> None:
+        """Add a generated reply as a variant for a key"""
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = [time.monotonic(), [], 0]
+        if len(entry[1]) < self.variants:
+            entry[1].append(reply)
+        
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        set_gauge("response_cache_entries", len(self._entries))
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Get the process-wide response cache, or None if response caching is off"""
+    global _response_cache
+    if _response_cache is None and RESPONSE_CACHE:
+        _response_cache = ResponseCache()
+    return _response_cache
+
+def set_response_cache(response_cache: Optional[ResponseCache]) -> None:
+    """Replace the response cache, e.g. to enable it in benchmarks"""
+    global _response_cache
+    _response_cache = response_cache
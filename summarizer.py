@@ -0,0 +1,113 @@
+"""
+Rolling summaries of conversation turns that were evicted from the stored history.
+Summaries are produced in the background after a reply is sent, so a turn never waits on them,
+and are included in the system prompt in place of the evicted messages.
+"""
+
+import os
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+from llm_providers import get_provider
+
+logger = logging.getLogger(__name__)
+
+# Which summariser to use: "mistral" (default), "local" (deterministic, no API calls) or "off"
+SUMMARIZER = os.getenv("SUMMARIZER", "mistral")
+# Evicted messages to collect before a summary is updated
+SUMMARY_BATCH_MESSAGES = int(os.getenv("SUMMARY_BATCH_MESSAGES", "10"))
+# Approximate maximum length of a summary in characters
+SUMMARY_MAX_CHARS = int(os.getenv("SUMMARY_MAX_CHARS", "1500"))
+
+class Summarizer:
+    """Base class for summarisers; subclasses fold new messages into an existing summary"""
+    async def summarize(self, character: Dict, previous_summary: str, messages: List[Dict]) -> str:
+        """Return a summary covering the previous summary and the new messages"""
+        raise NotImplementedError
+
+class MistralSummarizer(Summarizer):
+    """Summarises with a chat completion from the configured LLM provider (Mistral by default)"""
+    async def summarize(self, character: Dict, previous_summary: str, messages: List[Dict]) -> str:
+        transcript = "\n".join(
+            f"{'User' if m['role'] == 'user' else character['name']}: {m['content']}" for m in messages
+        )
+        prompt = (
+            f"Summary of the conversation so far:\n{previous_summary or '(none)'}\n\n"
+            f"New messages:\n{transcript}\n\n"
+            f"Write an updated summary in the third person, under {SUMMARY_MAX_CHARS} characters, "
+            f"keeping facts about the user, events, promises and the relationship with {character['name']}."
+        )
+        request = {
+            "messages": [
+                {"role": "system", "content": "You summarise roleplay conversations accurately and concisely."},
+                {"role": "user", "content": prompt}
+            ],
+            "temperature": 0.2,
+            "max_tokens": SUMMARY_MAX_CHARS // 3
+        }
+        
+        summary_text = await get_provider().complete(request)
+        return summary_text.strip()[:SUMMARY_MAX_CHARS]
+
+class LocalSummarizer(Summarizer):
+    """
+    Deterministic summariser without API calls: keeps the start of each message and
+    drops the oldest parts once the summary grows too long. Useful for tests and offline runs.
+    """
+    def __init__(self, chars_per_message: int = 120):
+        self.chars_per_message = chars_per_message
+    
+    async def summarize(self, character: Dict, previous_summary: str, messages: List[Dict]) -> str:
+        lines = [previous_summary] if previous_summary else []
+        for message in messages:
+            speaker = "User" if message["role"] == "user" else character["name"]
+            lines.append(f"{speaker}: {message['content'][:self.chars_per_message]}")
+        return "\n".join(lines)[-SUMMARY_MAX_CHARS:]
+
+_summarizer: Optional[Summarizer] = None
+
+# Conversations with a summary currently being produced
+_in_progress: Set[Tuple[int, str]] = set()
+
+def get_summarizer() -> Optional[Summarizer]:
+    """Get the configured summariser, or None if summarisation is off"""
+    global _summarizer
+    if _summarizer is None:
+        if SUMMARIZER == "mistral":
+            _summarizer = MistralSummarizer()
+        elif SUMMARIZER == "local":
+            _summarizer = LocalSummarizer()
+    return _summarizer
+
+def set_summarizer(summarizer: Optional[Summarizer]) -> None:
+    """Replace the summariser, e.g. with a deterministic stub in tests"""
+    global _summarizer
+    _summarizer = summarizer
+
+def needs_summary(character_manager, user_id: int, character_id: str) -> bool:
+    """Check whether enough evicted messages are waiting to update the summary"""
+    if get_summarizer() is None or (user_id, character_id) in _in_progress:
+        return False
+    return len(character_manager.get_pending_summary_messages(user_id, character_id)) >= SUMMARY_BATCH_MESSAGES
+
+async def update_conversation_summary(character_manager, user_id: int, character_id: str, character: Dict) -> None:
+    """Fold the pending evicted messages of a conversation into its summary"""
+    summarizer = get_summarizer()
+    key = (user_id, character_id)
+    if summarizer is None or key in _in_progress:
+        return
+    
+    _in_progress.add(key)
+    try:
+        pending = character_manager.get_pending_summary_messages(user_id, character_id)
+        if not pending:
+            return
+        
+        previous_summary = character_manager.get_conversation_summary(user_id, character_id) or ""
+        summary_text = await summarizer.summarize(character, previous_summary, pending)
+        
+        if not character_manager.apply_conversation_summary(user_id, character_id, summary_text, pending):
+            logger.info(f"Discarded summary for user {user_id} and {character_id}: conversation changed")
+    except Exception as e:
+        logger.error(f"Error summarising conversation for user {user_id}: {str(e)}")
+    finally:
+        _in_progress.discard(key)
@@ -0,0 +1,86 @@
+"""
+Token estimates and budget-driven selection of conversation history.
+The estimate is a local approximation of subword tokenizers, good enough to keep
+prompts within a budget without calling the API.
+"""
+
+import os
+import re
+import logging
+from typing import Dict, List, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Approximate token budget for one request's prompt (system prompt + history)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000"))
+
+# Tokens of history kept per conversation: about what the prompt has room for next to the system prompt and
+# the state. Messages that fall out of it leave the history and go to the summary and long-term memory,
+# so nothing is dropped from the prompt without being summarised first
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", str(CONTEXT_TOKEN_BUDGET * 2 // 3)))
+
+# Older messages are only truncated to fit if at least this many tokens of them would remain
+MIN_TRUNCATED_TOKENS = 32
+
+# Subword tokenizers average about four characters per token on English text
+CHARS_PER_TOKEN = 4
+
+_TOKEN_PIECE_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens in a text"""
+    tokens = 0
+    for piece in _TOKEN_PIECE_PATTERN.findall(text):
+        tokens += (len(piece) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return tokens
+
+def message_tokens(message: Dict) -> int:
+    """Get the token estimate of a history message, computing and caching it if missing"""
+    tokens = message.get("tokens")
+    if tokens is None:
+        tokens = estimate_tokens(message["content"])
+        message["tokens"] = tokens
+    return tokens
+
+def _truncate_to_tokens(text: str, tokens: int) -> str:
+    """Keep roughly the last `tokens` tokens of a text"""
+    return "…" + text[-tokens * CHARS_PER_TOKEN:].lstrip()
+
+def history_window_start(conversation_history: Sequence[Dict], budget: int) -> int:
+    """Index of the oldest of the most recent messages that fit in the token budget; the newest always fits"""
+    start = len(conversation_history)
+    remaining = budget
+    for message in reversed(conversation_history):
+        tokens = message_tokens(message)
+        if tokens > remaining and start < len(conversation_history):
+            break
+        remaining -= tokens
+        start -= 1
+    return start
+
+def fit_history_to_budget(conversation_history: List[Dict], budget: int) -> List[Dict]:
+    """
+    Select the most recent messages that fit in the token budget, oldest first.
+    The newest message is always included whole, even if it alone exceeds the budget;
+    the oldest message that only partly fits is truncated to its end if enough of it remains.
+    """
+    selected = []
+    remaining = budget
+    
+    for message in reversed(conversation_history):
+        tokens = message_tokens(message)
+        if tokens <= remaining:
+            selected.append({"role": message["role"], "content": message["content"]})
+            remaining -= tokens
+            continue
+        
+        if not selected:
+            logger.warning(f"Newest message ({tokens} tokens) exceeds the history budget of {budget} tokens; "
+                           f"sending it whole")
+            selected.append({"role": message["role"], "content": message["content"]})
+        elif remaining >= MIN_TRUNCATED_TOKENS:
+            selected.append({"role": message["role"], "content": _truncate_to_tokens(message["content"], remaining)})
+        break
+    
+    selected.reverse()
+    return selected
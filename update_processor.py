@@ -0,0 +1,109 @@
+"""
+Update processor that handles updates from different chats concurrently while
+keeping the updates of any single chat strictly in order.
+"""
+
+import os
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional, Set
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of updates handled at the same time across all chats
+MAX_CONCURRENT_UPDATES = int(os.getenv("MAX_CONCURRENT_UPDATES", "32"))
+
+class PerChatUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes updates of different chats concurrently, up to max_concurrent_updates at a time,
+    and updates of the same chat one after another in the order they arrived.
+    
+    Updates waiting for an earlier update of their chat don't count towards the concurrency limit,
+    so one busy chat can't starve the others. max_pending_updates bounds how many updates can be
+    waiting or running in total.
+    
+    The Application takes every update off its queue as soon as it arrives and starts a task for it,
+    so the queue never fills up. Webhook requests are admitted here instead: each admitted update holds
+    a slot until it has been processed, and no slot frees up while max_pending_updates are in flight.
+    """
+    def __init__(self, max_concurrent_updates: int = MAX_CONCURRENT_UPDATES,
+                 max_pending_updates: Optional[int] = None):
+        super().__init__(max_pending_updates or max_concurrent_updates * 8)
+        self.max_running_updates = max_concurrent_updates
+        self.max_pending_updates = max_pending_updates or max_concurrent_updates * 8
+        self._running = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._chat_locks: Dict[Any, asyncio.Lock] = {}
+        self._chat_waiters: Dict[Any, int] = {}
+        # Admitted updates, by id(), from admission until they are processed
+        self._admitted: Set[int] = set()
+        self._slot_freed = asyncio.Event()
+    
+    @property
+    def admitted_updates(self) -> int:
+        """Number of admitted updates that are queued or being processed"""
+        return len(self._admitted)
+    
+    async def admit(self, update: object, timeout: float) -> bool:
+        """
+        Take a slot for an update until it has been processed, waiting up to `timeout` seconds for one.
+        Returns False if every slot stayed taken.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self._admitted) >= self.max_pending_updates:
+            self._slot_freed.clear()
+            try:
+                await asyncio.wait_for(self._slot_freed.wait(), timeout=max(deadline - loop.time(), 0))
+            except asyncio.TimeoutError:
+                return False
+        self._admitted.add(id(update))
+        return True
+    
+    def release(self, update: object) -> None:
+        """Free the slot of an admitted update"""
+        if id(update) in self._admitted:
+            self._admitted.discard(id(update))
+            self._slot_freed.set()
+    
+    @staticmethod
+    def _chat_key(update: object) -> Optional[Any]:
+        """Get the key that orders an update: its chat, or its user if it has no chat"""
+        chat = getattr(update, "effective_chat", None)
+        if chat is not None:
+            return ("chat", chat.id)
+        user = getattr(update, "effective_user", None)
+        if user is not None:
+            return ("user", user.id)
+        return None
+    
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        """Wait for earlier updates of the same chat, then process within the concurrency limit"""
+        key = self._chat_key(update)
+        if key is None:
+            try:
+                async with self._running:
+                    await coroutine
+            finally:
+                self.release(update)
+            return
+        
+        lock = self._chat_locks.setdefault(key, asyncio.Lock())
+        self._chat_waiters[key] = self._chat_waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._running:
+                    await coroutine
+        finally:
+            self.release(update)
+            # Forget the chat once nothing is queued for it
+            self._chat_waiters[key] -= 1
+            if self._chat_waiters[key] == 0:
+                del self._chat_waiters[key]
+                del self._chat_locks[key]
+    
+    async def initialize(self) -> None:
+        """Nothing to set up"""
+    
+    async def shutdown(self) -> None:
+        """Nothing to tear down"""
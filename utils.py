@@ -2,8 +2,7 @@ import logging
 from typing import Dict, Any, Optional
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-
-from character_manager import CharacterManager
+from conversation_handler import cancel_reply
 
 logger = logging.getLogger(__name__)
 
@@ -25,7 +24,7 @@ async def handle_error(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 async def list_characters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """List all available characters"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get all characters
     all_characters = character_manager.get_all_characters()
@@ -69,7 +68,7 @@ async def list_characters(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def show_current_character(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show the user's currently selected character"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get the user's selected character
     user_id = update.effective_user.id
@@ -128,7 +127,7 @@ async def show_current_character(update: Update, context: ContextTypes.DEFAULT_T
 
 async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Reset the conversation with the current character"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get the user's selected character
     user_id = update.effective_user.id
@@ -148,7 +147,8 @@ async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
     
-    # Reset the conversation
+    # Reset the conversation, dropping any reply that is still being generated for it
+    cancel_reply(user_id, selected_character_id)
     character_manager.reset_conversation(user_id, selected_character_id)
     
     await update.message.reply_text(
@@ -157,7 +157,7 @@ async def reset_conversation(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def show_character_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Show detailed stats for the current character"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get the user's selected character
     user_id = update.effective_user.id
@@ -343,7 +343,7 @@ async def process_character_creation(update: Update, context: ContextTypes.DEFAU
             context.user_data["character_creation"]["traits"] = traits
             
             # Create the character
-            character_manager = CharacterManager()
+            character_manager = context.bot_data["character_manager"]
             
             # Get NSFW setting (default to False if not specified)
             is_nsfw = context.user_data["character_creation"].get("nsfw", False)
@@ -410,7 +410,7 @@ async def cancel_creation(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def delete_character(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Delete a custom character"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get the user's custom characters
     user_id = update.effective_user.id
@@ -473,7 +473,7 @@ def _create_stat_bar(value: float, max_value: int) -> str:
 
 async def toggle_nsfw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Toggle NSFW mode for the current character"""
-    character_manager = CharacterManager()
+    character_manager = context.bot_data["character_manager"]
     
     # Get the user's selected character
     user_id = update.effective_user.id
@@ -500,6 +500,7 @@ async def toggle_nsfw(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
     character = character_manager.get_character(selected_character_id)
     
     # Reset conversation after toggling NSFW mode to avoid confusion
+    cancel_reply(user_id, selected_character_id)
     character_manager.reset_conversation(user_id, selected_character_id)
     
     await update.message.reply_text(
@@ -0,0 +1,116 @@
+"""
+Webhook ingestion mode: an aiohttp endpoint that receives Telegram updates and feeds
+them into the Application's update queue, as an alternative to long polling. Updates are
+only accepted while the update processor has room for them, otherwise Telegram is asked
+to redeliver later.
+"""
+
+import os
+import hmac
+import json
+import asyncio
+import logging
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+from metrics import snapshot
+from update_processor import PerChatUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS URL Telegram should deliver updates to; webhook mode is used when it is set
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Secret Telegram sends back in the X-Telegram-Bot-Api-Secret-Token header
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Seconds to wait for room in the update processor before asking Telegram to retry later
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "2.0"))
+
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+def create_webhook_app(application: Application, secret_token: str) -> web.Application:
+    """Create the aiohttp app that accepts updates for the given Application"""
+    async def receive_update(request: web.Request) -> web.Response:
+        """Validate an update delivered by Telegram and put it on the update queue"""
+        if not hmac.compare_digest(request.headers.get(SECRET_TOKEN_HEADER, ""), secret_token):
+            logger.warning(f"Rejected webhook request from {request.remote}: bad secret token")
+            return web.Response(status=403)
+        
+        try:
+            update = Update.de_json(await request.json(), application.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError) as e:
+            logger.warning(f"Rejected malformed webhook update: {e}")
+            return web.Response(status=400)
+        
+        # The update holds a slot in the processor until it has been handled. Wait briefly for one;
+        # when every slot stays taken, make Telegram redeliver later
+        processor = application.update_processor
+        admitted = isinstance(processor, PerChatUpdateProcessor)
+        if admitted and not await processor.admit(update, WEBHOOK_ENQUEUE_TIMEOUT):
+            logger.warning(f"{processor.admitted_updates} updates are in flight, asking Telegram to retry")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        
+        try:
+            await asyncio.wait_for(application.update_queue.put(update), timeout=WEBHOOK_ENQUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            if admitted:
+                processor.release(update)
+            logger.warning("Update queue is full, asking Telegram to retry")
+            return web.Response(status=503, headers={"Retry-After": "1"})
+        
+        return web.Response(status=200)
+    
+    async def health(request: web.Request) -> web.Response:
+        """Report the update queue fill level and the updates in flight"""
+        processor = application.update_processor
+        return web.json_response({
+            "queued_updates": application.update_queue.qsize(),
+            "queue_size": application.update_queue.maxsize,
+            "updates_in_flight": getattr(processor, "admitted_updates", None),
+            "max_updates_in_flight": getattr(processor, "max_pending_updates", None)
+        })
+    
+    async def metrics(request: web.Request) -> web.Response:
+        """Serve a snapshot of the bot's metrics"""
+        return web.json_response(snapshot())
+    
+    webhook_app = web.Application()
+    webhook_app.router.add_post(WEBHOOK_PATH, receive_update)
+    webhook_app.router.add_get("/healthz", health)
+    webhook_app.router.add_get("/metrics", metrics)
+    return webhook_app
+
+async def run_webhook(application: Application, allowed_updates=None) -> None:
+    """Run the Application fed by the webhook endpoint until the task is cancelled"""
+    if not WEBHOOK_SECRET_TOKEN:
+        raise ValueError("WEBHOOK_SECRET_TOKEN environment variable not set!")
+    
+    runner = web.AppRunner(create_webhook_app(application, WEBHOOK_SECRET_TOKEN))
+    await runner.setup()
+    
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    
+    try:
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            allowed_updates=allowed_updates,
+            max_connections=100
+        )
+        logger.info(f"Receiving updates on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        
+        # Serve until cancelled (e.g. by Ctrl-C)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        if application.running:
+            await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)